@@ -0,0 +1,70 @@
+"""
+Startup time benchmark.
+
+Measures how long a fresh interpreter takes to import the app, how long
+create_app takes, and how long get_app takes once the app is cached, which
+is what worker boot and the test suite pay for.
+
+    python bench_startup.py
+    python bench_startup.py --database-url postgresql://localhost:5432/trivia
+"""
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(repeat):
+    """Seconds to import flaskr in a fresh interpreter, one per run."""
+    code = ('import time; started = time.perf_counter(); import flaskr; '
+            'print(time.perf_counter() - started)')
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], cwd=BACKEND_DIR)
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+    return timings
+
+
+def time_calls(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name, timings):
+    print(f'{name:<24} median {statistics.median(timings) * 1000:8.2f} ms'
+          f'   min {min(timings) * 1000:8.2f} ms'
+          f'   max {max(timings) * 1000:8.2f} ms   (n={len(timings)})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database-url', default='sqlite://',
+                        help='database for create_app (default: in-memory '
+                             'SQLite, no server needed)')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    from flaskr import create_app, get_app
+    logging.disable(logging.CRITICAL)
+
+    config = {'SQLALCHEMY_DATABASE_URI': args.database_url}
+    report('import flaskr', time_import(max(1, args.repeat // 4)))
+    report('create_app', time_calls(lambda: create_app(config), args.repeat))
+    get_app(config)
+    report('get_app (cached)',
+           time_calls(lambda: get_app(config), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
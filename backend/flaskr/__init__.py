@@ -1,14 +1,278 @@
 from werkzeug.exceptions import HTTPException, BadRequest
 import os
+import json
 import logging
 from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.exc import IntegrityError
 
-from models import setup_db, Question, Category, db
+from models import (setup_db, init_migrate, load_environment, missing_indexes,
+                    insert_questions, soft_delete_question, question_rows,
+                    count_question_rows, question_shards, init_question_shards,
+                    request_content_hash, Question, Category,
+                    IdempotencyKey, db)
+from .quiz import QuestionPool, parse_selection
+from .ratelimit import MemoryBackend, RateLimiter, RedisBackend
+from .scoring import ALL_CATEGORIES, AnswerKey, Leaderboards, answers_match
+from .singleflight import SingleFlight
+from . import formats
+from .changes import ChangeFeed
+from .precompute import Precomputer
+from .purge import DeletedQuestionPurger
+from .snapshots import PageSnapshots
+from .slowlog import SlowQueryLog
+from .writebehind import IdempotencyKeyReused, WriteBehindQueue
 
 QUESTIONS_PER_PAGE = 10
+QUIZ_MAX_BATCH = 50
+QUESTIONS_MAX_BATCH = 500
+LEADERBOARD_MAX_LIMIT = 100
+PLAYER_NAME_MAX_LENGTH = 80
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+# Quiz questions leave out the answer; POST /quizzes/answers checks guesses
+# and returns it.
+QUIZ_FIELDS = ('id', 'question', 'category', 'difficulty')
+
+# Per client limits for the endpoints that cost the most database time.
+DEFAULT_RATE_LIMITS = {
+    'search_questions': '30/minute',
+    'play_quiz': '60/minute',
+    # Also keeps answers from being guessed by brute force.
+    'check_answer': '120/minute',
+}
+
+
+def json_setting(name, default):
+    """
+    The JSON value of environment variable `name`, or `default` when it is
+    unset. Raises ValueError naming the variable when it is not valid JSON.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        raise ValueError(f'{name} is not valid JSON: {e}') from None
+
+
+def embed_category():
+    """
+    Whether the client asked for `?embed=category`, which adds each
+    question's category name as `category_type`. The listings and search
+    join categories into the query they already run, so it never costs a
+    query per row.
+    """
+    return 'category' in request.args.get('embed', '').split(',')
+
+
+def requested_fields():
+    """
+    The question fields named by `?fields=`, in QUESTION_FIELDS order, or
+    all of them. Only these columns are selected from the database, so a
+    list that hides answers until reveal never reads them. Aborts with 422
+    on an unknown field.
+    """
+    names = {name.strip()
+             for name in request.args.get('fields', '').split(',')
+             if name.strip()}
+    if not names:
+        return QUESTION_FIELDS
+    unknown = names.difference(QUESTION_FIELDS)
+    if unknown:
+        abort(422, 'Unknown question fields: ' + ', '.join(sorted(unknown)))
+    return tuple(field for field in QUESTION_FIELDS if field in names)
+
+
+def select_fields(query, fields, embed=False):
+    """
+    `query` narrowed to the id, the columns for `fields` and category_type,
+    ordered by id, as models.question_rows expects.
+    """
+    columns = [Question.id] + [getattr(Question, field)
+                               for field in fields if field != 'id']
+    if embed:
+        query = query.outerjoin(Question.category_obj)
+        columns.append(Category.type)
+    return query.with_entities(*columns).order_by(Question.id)
+
+
+def row_keys(fields, embed=False):
+    """
+    The keys format_rows gives each question: `fields`, then the category
+    name with `embed`. They are the columns of the columnar formats.
+    """
+    return fields + ('category_type',) if embed else fields
+
+
+def format_rows(rows, fields):
+    """Question dicts for rows from select_fields, like Question.format()."""
+    columns = [field for field in fields if field != 'id']
+    formatted_questions = []
+    for row in rows:
+        formatted = dict(zip(columns, row[1:]))
+        if 'id' in fields:
+            formatted['id'] = row[0]
+        if len(row) > len(columns) + 1 and row[-1] is not None:
+            formatted['category_type'] = row[-1]
+        formatted_questions.append(formatted)
+    return formatted_questions
+
+
+"""
+Read endpoint payloads. They return plain dicts (or None for a 404) rather
+than responses so that SingleFlight can hand one result to every concurrent
+request for the same page.
+"""
+
+
+def categories_page():
+    return {
+        'success': True,
+        'categories': {
+            category.id: category.type for category in Category.query.all()
+        }
+    }
+
+
+def questions_page(page, embed=False, fields=QUESTION_FIELDS):
+    query = select_fields(Question.live(), fields, embed)
+    questions = question_rows(
+        query, offset=(max(page, 1) - 1) * QUESTIONS_PER_PAGE,
+        limit=QUESTIONS_PER_PAGE)
+    if not questions:
+        return None
+
+    categories = {
+        category.id: category.type for category in Category.query.all()}
+
+    return {
+        'success': True,
+        'questions': format_rows(questions, fields),
+        'total_questions': count_question_rows(query),
+        'categories': categories,
+        'current_category': None
+    }
+
+
+def category_questions_page(category_id, embed=False,
+                            fields=QUESTION_FIELDS):
+    category = Category.query.get(category_id)
+    if not category:
+        return None
+
+    questions = question_rows(select_fields(Question.live().filter(
+        Question.category == category_id), fields, embed),
+        category=category_id)
+
+    return {
+        'success': True,
+        'questions': format_rows(questions, fields),
+        'total_questions': len(questions),
+        'current_category': category.type
+    }
+
+
+def export_page(fields=QUESTION_FIELDS):
+    """Every live question, in id order, for GET /questions/export."""
+    rows = question_rows(select_fields(Question.live(), fields))
+    return {
+        'success': True,
+        'questions': format_rows(rows, fields),
+        'total_questions': len(rows)
+    }
+
+
+def snapshot_payloads(pages):
+    """
+    The pages PageSnapshots keeps pre-serialized: the first `pages` pages of
+    /questions and every category listing, without embedded categories.
+    """
+    for page in range(1, pages + 1):
+        payload = questions_page(page)
+        if payload is None:
+            break
+        yield ('questions', page), payload
+    for category_id, in db.session.query(Category.id).all():
+        yield (('category_questions', category_id),
+               category_questions_page(category_id))
+
+
+def is_complete_question(item):
+    return isinstance(item, dict) and all(
+        item.get(field)
+        for field in ('question', 'answer', 'difficulty', 'category'))
+
+
+def replay(stored):
+    """Response for a request whose Idempotency-Key was already used."""
+    response = jsonify(stored.format())
+    response.status_code = stored.status_code
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotency_key_reused():
+    """422 response for an Idempotency-Key sent with a different body."""
+    return jsonify({
+        'success': False,
+        'error': 422,
+        'message': 'Idempotency-Key was already used for a different request'
+    }), 422
+
+
+def accepted(mutation, created=True):
+    """202 response for a mutation queued in write-behind mode."""
+    status_url = f'/mutations/{mutation["id"]}'
+    response = jsonify({
+        'success': True,
+        'mutation_id': mutation['id'],
+        'status': mutation['status'],
+        'status_url': status_url
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    if not created:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def check_indexes(app):
+    """
+    Warn when indexes the hot filters depend on are missing, which usually
+    means `flask db upgrade` has not been run against the database. With
+    question shards, the shards are checked instead.
+    """
+    with app.app_context():
+        try:
+            shards = question_shards()
+            engines = ([db.engine] if shards.count == 1 else
+                       [shards.bind(shard) for shard in shards.all()])
+            missing = sorted({name for engine in engines
+                              for name in missing_indexes(engine)})
+        except Exception as e:
+            app.logger.warning(f'Could not check database indexes: {e}')
+            return
+    if missing:
+        app.logger.warning(
+            'Missing database indexes: %s. Filters on these columns will use '
+            'sequential scans; run `flask db upgrade`.', ', '.join(missing))
+
+
+_apps = {}
+
+
+def get_app(test_config=None):
+    """
+    Cached create_app: returns the app already built for an identical
+    config, so callers that need an app repeatedly (the test suite, scripts)
+    pay for building it once.
+    """
+    key = repr(sorted((test_config or {}).items()))
+    if key not in _apps:
+        _apps[key] = create_app(test_config)
+    return _apps[key]
 
 
 def create_app(test_config=None):
@@ -16,13 +280,243 @@ def create_app(test_config=None):
     print("Creating Falsk app...")
     app = Flask(__name__)
     logging.basicConfig(level=logging.DEBUG)
+    load_environment()
+
+    app.config.from_mapping(
+        QUIZ_POOL_TTL=int(os.environ.get('QUIZ_POOL_TTL', 60)),
+        CHECK_INDEXES=os.environ.get('CHECK_INDEXES', '1') == '1',
+        SLOW_QUERY_LOG=os.environ.get('SLOW_QUERY_LOG', '0') == '1',
+        SLOW_QUERY_THRESHOLD_MS=float(
+            os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100)),
+        SLOW_QUERY_EXPLAIN=os.environ.get('SLOW_QUERY_EXPLAIN', '0') == '1',
+        SLOW_QUERY_BUFFER_SIZE=int(
+            os.environ.get('SLOW_QUERY_BUFFER_SIZE', 100)),
+        RATELIMIT_ENABLED=os.environ.get('RATELIMIT_ENABLED', '1') == '1',
+        RATELIMIT_RULES=json_setting('RATELIMIT_RULES', DEFAULT_RATE_LIMITS),
+        RATELIMIT_KEY_RULES=json_setting('RATELIMIT_KEY_RULES', {}),
+        RATELIMIT_STORAGE_URL=os.environ.get('RATELIMIT_STORAGE_URL'),
+        TRUSTED_PROXIES=int(os.environ.get('TRUSTED_PROXIES', 0)),
+        WRITE_BEHIND=os.environ.get('WRITE_BEHIND', '0') == '1',
+        WRITE_BEHIND_PATH=os.environ.get(
+            'WRITE_BEHIND_PATH',
+            os.path.join(app.instance_path, 'write_behind.sqlite3')),
+        WRITE_BEHIND_BATCH_SIZE=int(
+            os.environ.get('WRITE_BEHIND_BATCH_SIZE', 100)),
+        WRITE_BEHIND_INTERVAL=float(
+            os.environ.get('WRITE_BEHIND_INTERVAL', 1.0)),
+        WRITE_BEHIND_WORKER=True,
+        SNAPSHOT_PAGES=int(os.environ.get('SNAPSHOT_PAGES', 5)),
+        SNAPSHOT_INTERVAL=float(os.environ.get('SNAPSHOT_INTERVAL', 60)),
+        SNAPSHOT_WORKER=True,
+        PURGE_RETENTION=int(os.environ.get('PURGE_RETENTION', 86400)),
+        PURGE_INTERVAL=int(os.environ.get('PURGE_INTERVAL', 3600)),
+        PURGE_BATCH_SIZE=int(os.environ.get('PURGE_BATCH_SIZE', 1000)),
+        IDEMPOTENCY_KEY_TTL=int(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400)),
+        LEADERBOARD_FLUSH_INTERVAL=int(
+            os.environ.get('LEADERBOARD_FLUSH_INTERVAL', 30)),
+        PRECOMPUTE_WORKERS=int(os.environ.get('PRECOMPUTE_WORKERS', 0)),
+        PRECOMPUTE_INTERVAL=float(
+            os.environ.get('PRECOMPUTE_INTERVAL', 60)),
+        PRECOMPUTE_WORKER=True,
+        CHANGE_FEED_SIZE=int(os.environ.get('CHANGE_FEED_SIZE', 1000)),
+        CHANGE_FEED_TIMEOUT=float(
+            os.environ.get('CHANGE_FEED_TIMEOUT', 300)),
+        CHANGE_FEED_KEEPALIVE=float(
+            os.environ.get('CHANGE_FEED_KEEPALIVE', 15)),
+        QUESTION_SHARDS=[
+            url for url in os.environ.get('QUESTION_SHARDS', '').split(',')
+            if url],
+    )
 
     if test_config is None:
         setup_db(app)
     else:
+        app.config.update(test_config)
         database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
         setup_db(app, database_path=database_path)
 
+    from_cli = os.environ.get('FLASK_RUN_FROM_CLI') == 'true'
+    if from_cli:
+        init_migrate(app)
+
+    # Behind that many reverse proxies, take the client address (which the
+    # rate limits key on) and scheme from the X-Forwarded-* headers they
+    # add. Off by default: without a proxy, clients could forge them.
+    if app.config['TRUSTED_PROXIES'] > 0:
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    # Work that needs the database waits for the first request instead of
+    # slowing down every worker boot, and never runs for CLI commands such
+    # as `flask db upgrade`.
+    first_request_tasks = []
+    if app.config['CHECK_INDEXES']:
+        first_request_tasks.append(lambda: check_indexes(app))
+
+    @app.before_request
+    def run_first_request_tasks():
+        while first_request_tasks:
+            try:
+                task = first_request_tasks.pop(0)
+            except IndexError:
+                break
+            task()
+
+    def start_worker(worker):
+        if from_cli:
+            first_request_tasks.append(lambda: worker.start(app))
+        else:
+            worker.start(app)
+
+    # Quiz buckets and the search trigram index built in a process pool;
+    # see precompute.py.
+    precomputer = None
+    if app.config['PRECOMPUTE_WORKERS'] > 0:
+        precomputer = Precomputer(
+            app.config['PRECOMPUTE_WORKERS'],
+            interval=app.config['PRECOMPUTE_INTERVAL'],
+            ttl=app.config['QUIZ_POOL_TTL'])
+        app.extensions['precomputer'] = precomputer
+        if app.config['PRECOMPUTE_WORKER']:
+            start_worker(precomputer)
+
+    question_pool = QuestionPool(
+        ttl=app.config['QUIZ_POOL_TTL'], precomputer=precomputer)
+    # Concurrent identical reads of /categories, /questions pages and
+    # category listings share one query; see singleflight.py.
+    single_flight = SingleFlight()
+
+    # Hot pages served as pre-encoded bytes; see snapshots.py. Warming runs
+    # on a background thread, so it does not delay startup, and CLI
+    # commands do not start it.
+    snapshots = None
+    if app.config['SNAPSHOT_PAGES'] > 0:
+        pages = app.config['SNAPSHOT_PAGES']
+        snapshots = PageSnapshots(
+            lambda: snapshot_payloads(pages),
+            interval=app.config['SNAPSHOT_INTERVAL'])
+        app.extensions['page_snapshots'] = snapshots
+        if app.config['SNAPSHOT_WORKER']:
+            start_worker(snapshots)
+
+    def snapshot_response(key):
+        # Snapshots are plain JSON; other formats are encoded per request.
+        if snapshots is None or formats.negotiate() != formats.JSON:
+            return None
+        blob = snapshots.get(key)
+        if blob is None:
+            return None
+        response = app.response_class(blob, mimetype=formats.JSON)
+        response.vary.add('Accept')
+        return response
+
+    if app.config['RATELIMIT_ENABLED']:
+        storage_url = app.config['RATELIMIT_STORAGE_URL']
+        try:
+            rate_limiter = RateLimiter(
+                app.config['RATELIMIT_RULES'],
+                key_rules=app.config['RATELIMIT_KEY_RULES'],
+                backend=RedisBackend(storage_url) if storage_url
+                else MemoryBackend())
+        except ValueError as e:
+            raise ValueError('Invalid RATELIMIT_RULES or '
+                             f'RATELIMIT_KEY_RULES: {e}') from None
+
+        @app.before_request
+        def limit_rate():
+            retry_after = rate_limiter.check(
+                request.endpoint, request.remote_addr,
+                api_key=request.headers.get('X-API-Key'))
+            if retry_after is not None:
+                return jsonify({
+                    'success': False,
+                    'error': 429,
+                    'message': 'Too Many Requests'
+                }), 429, {'Retry-After': str(retry_after)}
+
+    slow_query_log = None
+    if app.config['SLOW_QUERY_LOG']:
+        slow_query_log = SlowQueryLog(
+            threshold_ms=app.config['SLOW_QUERY_THRESHOLD_MS'],
+            explain=app.config['SLOW_QUERY_EXPLAIN'],
+            size=app.config['SLOW_QUERY_BUFFER_SIZE'])
+        with app.app_context():
+            slow_query_log.attach(db.engine)
+            shards = question_shards()
+            if shards.count > 1:
+                for shard in shards.all():
+                    slow_query_log.attach(shards.bind(shard))
+
+    # Created and deleted questions, streamed to clients at
+    # /questions/changes; see changes.py.
+    changes = ChangeFeed(
+        size=app.config['CHANGE_FEED_SIZE'],
+        timeout=app.config['CHANGE_FEED_TIMEOUT'],
+        keepalive=app.config['CHANGE_FEED_KEEPALIVE'])
+    app.extensions['question_changes'] = changes
+
+    # Write-behind mode queues question mutations locally and applies them
+    # in batches; see writebehind.py. The worker starts right away, to
+    # apply what an earlier run left queued (under `flask run`, with the
+    # first request). Enqueueing starts it too, so forking servers get one
+    # in each worker.
+    write_behind = None
+    if app.config['WRITE_BEHIND']:
+        write_behind = WriteBehindQueue(
+            app.config['WRITE_BEHIND_PATH'],
+            batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+            interval=app.config['WRITE_BEHIND_INTERVAL'],
+            changes=changes)
+        app.extensions['write_behind'] = write_behind
+        if app.config['WRITE_BEHIND_WORKER']:
+            start_worker(write_behind)
+
+    # Deleted questions are only flagged; this removes them in batches once
+    # they are PURGE_RETENTION seconds old. See purge.py.
+    purger = DeletedQuestionPurger(
+        retention=app.config['PURGE_RETENTION'],
+        interval=app.config['PURGE_INTERVAL'],
+        batch_size=app.config['PURGE_BATCH_SIZE'],
+        key_ttl=app.config['IDEMPOTENCY_KEY_TTL'])
+    app.extensions['question_purger'] = purger
+    if purger.interval > 0:
+        start_worker(purger)
+
+    # Answers are checked against normalized copies kept in memory, and
+    # leaderboards are written back in batches; see scoring.py.
+    answer_key = AnswerKey(ttl=app.config['QUIZ_POOL_TTL'])
+    leaderboards = Leaderboards(
+        flush_interval=app.config['LEADERBOARD_FLUSH_INTERVAL'])
+    app.extensions['leaderboards'] = leaderboards
+    if leaderboards.flush_interval > 0:
+        start_worker(leaderboards)
+
+    @app.cli.command('purge-deleted-questions')
+    def purge_deleted_questions_command():
+        """
+        Remove soft-deleted questions past PURGE_RETENTION and idempotency
+        keys past IDEMPOTENCY_KEY_TTL.
+        """
+        print(f'Purged {purger.purge()} deleted questions and '
+              f'{purger.expire_idempotency_keys()} idempotency keys.')
+
+    @app.cli.command('init-question-shards')
+    def init_question_shards_command():
+        """
+        Create the question tables on every QUESTION_SHARDS database and
+        copy the main database's questions into empty shards.
+        """
+        shards, copied = init_question_shards()
+        print(f'Initialized {shards} question shards '
+              f'and copied {copied} questions into them.')
+
+    def enqueue_mutation(operation, payload, idempotency_key=None):
+        if app.config['WRITE_BEHIND_WORKER']:
+            write_behind.start(app)
+        return write_behind.enqueue(
+            operation, payload, idempotency_key=idempotency_key)
+
     """
     @DONE: Set up CORS. Allow '*' for origins. Delete the sample route after
     completing the TODOs
@@ -58,15 +552,7 @@ def create_app(test_config=None):
     @app.route('/categories', methods=['GET'])
     def get_categories():
         try:
-            categories = Category.query.all()
-            categories_dict = {
-                category.id: category.type for category in categories
-            }
-
-            return jsonify({
-                'success': True,
-                'categories': categories_dict
-            })
+            return jsonify(single_flight.do(('categories',), categories_page))
         except Exception as e:
             print(e)
             return jsonify({
@@ -91,24 +577,19 @@ def create_app(test_config=None):
     def questions():
         if request.method == 'GET':
             page = request.args.get('page', 1, type=int)
-            questions = Question.query.paginate(
-                page=page, per_page=10, error_out=False)
-            if not questions.items:
-                abort(404)
+            embed = embed_category()
+            fields = requested_fields()
 
-            try:
-                formatted_questions = [question.format()
-                                       for question in questions.items]
-                categories = {
-                    category.id: category.type for category in Category.query.all()}
+            response = None
+            if not embed and fields == QUESTION_FIELDS:
+                response = snapshot_response(('questions', page))
+            if response is not None:
+                return response
 
-                return jsonify({
-                    'success': True,
-                    'questions': formatted_questions,
-                    'total_questions': questions.total,
-                    'categories': categories,
-                    'current_category': None
-                })
+            try:
+                payload = single_flight.do(
+                    ('questions', page, embed, fields),
+                    lambda: questions_page(page, embed, fields))
             except Exception as e:
                 print(e)
                 return jsonify({
@@ -117,43 +598,106 @@ def create_app(test_config=None):
                     'message': 'An error occurred while fetching the questions'
                 }), 500
 
+            if payload is None:
+                abort(404)
+            return formats.render(payload, row_keys(fields, embed))
+
         elif request.method == 'POST':
+            idempotency_key = request.headers.get('Idempotency-Key')
             try:
                 data = request.get_json()
 
                 if not data:
                     abort(400, 'Request body cannot be empty')
 
-                question = data.get('question', None)
-                answer = data.get('answer', None)
-                difficulty = data.get('difficulty', None)
-                category = data.get('category', None)
+                request_hash = request_content_hash(data)
+                if idempotency_key and write_behind is None:
+                    stored = IdempotencyKey.query.get(idempotency_key)
+                    if stored and stored.expired(
+                            app.config['IDEMPOTENCY_KEY_TTL']):
+                        # Not purged yet; the key is free to use again.
+                        db.session.delete(stored)
+                        db.session.flush()
+                        stored = None
+                    if stored:
+                        if not stored.matches(request_hash):
+                            return idempotency_key_reused()
+                        return replay(stored)
 
-                if not all([question, answer, difficulty, category]):
+                batch = isinstance(data, list) or 'questions' in data
+                items = data if isinstance(data, list) else (
+                    data.get('questions') if batch else [data])
+
+                if (not isinstance(items, list)
+                        or not 0 < len(items) <= QUESTIONS_MAX_BATCH
+                        or not all(is_complete_question(item)
+                                   for item in items)):
                     return jsonify({
                         'success': False,
                         'error': 422,
                         'message': 'Request data is incomplete'
                     }), 422
 
-                new_question = Question(
-                    question=question,
-                    answer=answer,
-                    difficulty=difficulty,
-                    category=category,
-                )
+                if write_behind is not None:
+                    try:
+                        return accepted(*enqueue_mutation(
+                            'create', {'questions': items},
+                            idempotency_key=idempotency_key))
+                    except IdempotencyKeyReused:
+                        return idempotency_key_reused()
+
+                results = insert_questions(items)
+                if batch:
+                    body = {
+                        'success': True,
+                        'questions': [
+                            {'question_id': question_id, 'created': created}
+                            for question_id, created in results],
+                        'total_created': sum(
+                            created for _, created in results)
+                    }
+                    status_code = 201 if body['total_created'] else 200
+                else:
+                    question_id, created = results[0]
+                    body = {
+                        'success': True,
+                        'created': items[0]['question'],
+                        'question_id': question_id,
+                        'duplicate': not created
+                    }
+                    status_code = 201 if created else 200
 
-                db.session.add(new_question)
+                if idempotency_key:
+                    if question_shards().count > 1:
+                        # The key and the questions are in different
+                        # databases, which commit one after the other.
+                        # Questions go first: if storing the key fails, a
+                        # retry finds them by content and gets the same ids
+                        # back instead of inserting them again.
+                        db.session.commit()
+                    db.session.add(IdempotencyKey(
+                        idempotency_key, status_code, body, request_hash))
                 db.session.commit()
+                for (question_id, created), item in zip(results, items):
+                    if created:
+                        changes.question_created(question_id, item)
 
-                return jsonify({
-                    'success': True,
-                    'created': new_question.question,
-                    'question_id': new_question.id
-                }), 201
+                return jsonify(body), status_code
 
             except BadRequest:
                 abort(400, description='Request body cannot be empty')
+            except IntegrityError as e:
+                # Lost a race with a request using the same idempotency key
+                # (or, outside PostgreSQL, inserting the same question).
+                db.session.rollback()
+                print(f'error: {e}')
+                stored = idempotency_key and IdempotencyKey.query.get(
+                    idempotency_key)
+                if stored:
+                    if not stored.matches(request_content_hash(data)):
+                        return idempotency_key_reused()
+                    return replay(stored)
+                abort(409)
             except Exception as e:
                 db.session.rollback()
                 print(f'error: {e}')
@@ -176,7 +720,8 @@ def create_app(test_config=None):
     @app.route('/questions/<int:question_id>', methods=['GET', 'DELETE'])
     def delete_question(question_id):
         if request.method == 'GET':
-            question = Question.query.get(question_id)
+            question = question_rows(
+                select_fields(Question.live(), ('id',)), ids=[question_id])
             if not question:
                 return jsonify({
                     'success': False,
@@ -185,17 +730,23 @@ def create_app(test_config=None):
                 }), 404
 
         elif request.method == 'DELETE':
+            if write_behind is not None:
+                # Not looked up here: a missing question shows up as a failed
+                # mutation at the status URL.
+                return accepted(*enqueue_mutation(
+                    'delete', {'question_id': question_id}))
+
             try:
-                question = Question.query.get(question_id)
-                if not question:
+                # A flag update; the row itself is purged later.
+                if not soft_delete_question(question_id):
                     return jsonify({
                         'success': False,
                         'error': 404,
                         'message': 'Question not found'
                     }), 404
 
-                db.session.delete(question)
                 db.session.commit()
+                changes.question_deleted(question_id)
 
                 return jsonify({
                     'success': True,
@@ -218,6 +769,12 @@ def create_app(test_config=None):
     which will require the question and answer text,
     category, and difficulty score.
 
+    The body may also be a list of questions (or {"questions": [...]}),
+    inserted in one transaction. Questions whose normalized text, answer and
+    category already exist are not inserted again; their existing id is
+    returned instead. Requests with an `Idempotency-Key` header store their
+    response, and a retry with the same key gets that response back.
+
     TEST: When you submit a question on the "Add" tab,
     the form will clear and the question will appear at the end of the last
     page of the questions list in the "List" tab.
@@ -225,6 +782,22 @@ def create_app(test_config=None):
     This was added to /questions
     """
 
+    """
+    A Server-Sent Events stream of created and deleted questions, so the
+    list view can update in place instead of refetching pages. Reconnects
+    resume from the Last-Event-ID header; see changes.py.
+    """
+    @app.route('/questions/changes', methods=['GET'])
+    def question_changes():
+        last_event_id = (request.headers.get('Last-Event-ID')
+                         or request.args.get('last_event_id'))
+        response = app.response_class(
+            changes.stream(last_event_id), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Keep nginx from buffering the stream.
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
     """
     @DONE:
     Create a POST endpoint to get questions based on a search term.
@@ -238,22 +811,28 @@ def create_app(test_config=None):
 
     @app.route('/questions/search', methods=['POST'])
     def search_questions():
+        fields = requested_fields()
+        embed = embed_category()
         try:
             data = request.get_json()
             if data is None:
                 raise BadRequest("Invalis JSON")
             search_term = data.get('searchTerm', '')
 
-            questions = Question.query.filter(
-                Question.question.ilike(f'%{search_term}%')
-            ).all()
-            formatted_questions = [question.format() for question in questions]
+            query = select_fields(Question.live().filter(
+                Question.question.ilike(f'%{search_term}%')),
+                fields, embed)
+            # Only the candidates, if any, contain every trigram of the term.
+            candidates = None
+            if precomputer is not None and isinstance(search_term, str):
+                candidates = precomputer.search_candidates(search_term)
+            questions = question_rows(query, ids=candidates)
 
-            return jsonify({
+            return formats.render({
                 'success': True,
-                'questions': formatted_questions,
+                'questions': format_rows(questions, fields),
                 'total_questions': len(questions)
-            }), 200
+            }, row_keys(fields, embed))
 
         except BadRequest as e:
             print(f'Bad Request Error: {e}')
@@ -272,20 +851,31 @@ def create_app(test_config=None):
     """
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
     def get_questions_by_category(category_id):
-        category = Category.query.get(category_id)
-        if not category:
+        embed = embed_category()
+        fields = requested_fields()
+        response = None
+        if not embed and fields == QUESTION_FIELDS:
+            response = snapshot_response(('category_questions', category_id))
+        if response is not None:
+            return response
+
+        payload = single_flight.do(
+            ('category_questions', category_id, embed, fields),
+            lambda: category_questions_page(category_id, embed, fields))
+        if payload is None:
             abort(404, 'Category not found')
 
-        questions = Question.query.filter(
-            Question.category == category_id).all()
-        formatted_questions = [question.format() for question in questions]
+        return formats.render(payload, row_keys(fields, embed))
 
-        return jsonify({
-            'success': True,
-            'questions': formatted_questions,
-            'total_questions': len(questions),
-            'current_category': category.type
-        }), 200
+    """
+    Every live question in one response, for batch clients. Like the other
+    listings it can be sent as columnar JSON or MessagePack; see formats.py.
+    """
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions():
+        fields = requested_fields()
+        return formats.render(single_flight.do(
+            ('export', fields), lambda: export_page(fields)), fields)
 
     """
     @DONE:
@@ -297,46 +887,180 @@ def create_app(test_config=None):
     TEST: In the "Play" tab, after a user selects "All" or a category,
     one question at a time is displayed, the user is allowed to answer
     and shown whether they were correct or not.
+
+    Optional body fields narrow the draw by difficulty: `difficulty` for an
+    exact level, `min_difficulty`/`max_difficulty` for a range and
+    `target_difficulty` to favour questions close to a target, which adaptive
+    clients move as the player answers. Questions come from QuestionPool, so
+    each draw is O(1) instead of a query over every candidate.
+
+    Passing `num_questions` returns a whole pre-drawn quiz as `questions`:
+    that many distinct questions sampled without replacement and loaded in
+    one query per shard, so a quiz costs one request instead of one per
+    question.
     """
+    def draw_questions(selection, count, previous_questions):
+        """
+        Draw `count` distinct questions from the pool and load them with a
+        single query per shard involved (one for a category quiz), formatted
+        and in the order they were drawn.
+        """
+        for _ in range(2):
+            question_ids = question_pool.draw_many(
+                selection, count, exclude=previous_questions)
+            if not question_ids:
+                return []
+            by_id = {
+                question['id']: question for question in format_rows(
+                    question_rows(
+                        select_fields(Question.live(), QUIZ_FIELDS),
+                        ids=question_ids),
+                    QUIZ_FIELDS)}
+            if len(by_id) == len(question_ids):
+                break
+            # The pool is older than the table; rebuild it and retry.
+            question_pool.invalidate()
+        return [by_id[question_id]
+                for question_id in question_ids if question_id in by_id]
+
     @app.route('/quizzes', methods=['POST'])
     def play_quiz():
         try:
             data = request.get_json()
-            quiz_category = data.get('quiz_category')
+            selection = parse_selection(data)
             previous_questions = data.get('previous_questions', [])
+            if not isinstance(previous_questions, list):
+                raise ValueError('previous_questions must be a list')
 
-            # Debug logging
-            print(f"Received data: {data}")
-            print(f"Quiz category: {quiz_category}")
-            print(f"Previous questions: {previous_questions}")
+            num_questions = data.get('num_questions')
+            if num_questions is not None:
+                if (isinstance(num_questions, bool)
+                        or not isinstance(num_questions, int)
+                        or not 0 < num_questions <= QUIZ_MAX_BATCH):
+                    raise ValueError('num_questions must be between 1 '
+                                     f'and {QUIZ_MAX_BATCH}')
+                questions = draw_questions(
+                    selection, num_questions, previous_questions)
+                return jsonify({
+                    'success': True,
+                    'questions': questions,
+                    'total_questions': len(questions)
+                }), 200
 
-            # Base query
-            query = Question.query.filter(
-                Question.id.notin_(previous_questions))
+            questions = draw_questions(selection, 1, previous_questions)
+
+            return jsonify({
+                'success': True,
+                'question': questions[0] if questions else None
+            }), 200
 
-            # If a specific category is selected (not "All")
-            if quiz_category and quiz_category.get('id') != 0:
-                query = query.filter(Question.category == quiz_category['id'])
+        except Exception as e:
+            print(f'Error in play_quiz: {e}')
+            abort(422)
 
-            # Get all available questions
-            questions = query.all()
+    """
+    Check a quiz answer on the server. The body has `question_id`, the
+    player's `answer` and optionally a `player` name. The response has the
+    question's answer, which /quizzes leaves out. The first correct answer
+    to a question from a named player scores a point on the question's
+    category leaderboard and the overall one, and the response includes
+    their new score and rank there.
+    """
+    @app.route('/quizzes/answers', methods=['POST'])
+    def check_answer():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            abort(422)
+        question_id = data.get('question_id')
+        guess = data.get('answer')
+        player = data.get('player')
+        if (isinstance(question_id, bool) or not isinstance(question_id, int)
+                or not isinstance(guess, str)
+                or (player is not None and (
+                    not isinstance(player, str) or not player.strip()
+                    or len(player) > PLAYER_NAME_MAX_LENGTH))):
+            abort(422)
 
-            # Debug print
-            print(f"Number of questions found: {len(questions)}")
+        entry = answer_key.get(question_id)
+        if entry is None:
+            abort(404)
+        normalized, answer, category_id = entry
 
-            if questions:
-                question = random.choice(questions).format()
+        body = {
+            'success': True,
+            'question_id': question_id,
+            'correct': answers_match(guess, normalized),
+            'answer': answer
+        }
+        if player is not None:
+            player = player.strip()
+            if body['correct']:
+                score, rank = leaderboards.score(
+                    player, category_id, question_id)
             else:
-                question = None
+                score, rank = leaderboards.standing(player, category_id)
+            body.update(player=player, category_id=category_id,
+                        score=score, rank=rank)
+        return jsonify(body)
+
+    """
+    Top players of a category, or of all categories with category 0.
+    `limit` (default 10, up to 100) sets how many; `player` adds that
+    player's own score and rank.
+    """
+    @app.route('/leaderboards/<int:category_id>', methods=['GET'])
+    def get_leaderboard(category_id):
+        if (category_id != ALL_CATEGORIES
+                and Category.query.get(category_id) is None):
+            abort(404)
+        limit = request.args.get('limit', 10, type=int)
+        if not 0 < limit <= LEADERBOARD_MAX_LIMIT:
+            abort(422)
+
+        body = {
+            'success': True,
+            'category_id': category_id,
+            'leaders': leaderboards.top(category_id, limit)
+        }
+        player = request.args.get('player')
+        if player:
+            score, rank = leaderboards.standing(player, category_id)
+            body['player'] = {'player': player, 'score': score, 'rank': rank}
+        return jsonify(body)
+
+    """
+    Recent queries slower than SLOW_QUERY_THRESHOLD_MS, newest first, with
+    the route that issued them and, when SLOW_QUERY_EXPLAIN is set, their
+    query plan. Only registered when SLOW_QUERY_LOG is enabled.
+    """
+    if slow_query_log is not None:
+        @app.route('/debug/slow-queries', methods=['GET', 'DELETE'])
+        def slow_queries():
+            if request.method == 'DELETE':
+                slow_query_log.clear()
 
             return jsonify({
                 'success': True,
-                'question': question
-            }), 200
+                'threshold_ms': slow_query_log.threshold_ms,
+                'queries': slow_query_log.entries()
+            })
 
-        except Exception as e:
-            print(f'Error in play_quiz: {e}')
-            abort(422)
+    """
+    Status of a mutation queued in write-behind mode: pending, applying,
+    applied (with its result) or failed (with the error). Only registered
+    when WRITE_BEHIND is enabled.
+    """
+    if write_behind is not None:
+        @app.route('/mutations/<int:mutation_id>', methods=['GET'])
+        def get_mutation(mutation_id):
+            mutation = write_behind.get(mutation_id)
+            if mutation is None:
+                abort(404)
+
+            return jsonify({
+                'success': True,
+                'mutation': mutation
+            })
 
     """
     @DONE:
@@ -351,6 +1075,14 @@ def create_app(test_config=None):
             'message': 'Not Found'
         }), 404
 
+    @app.errorhandler(409)
+    def conflict(error):
+        return jsonify({
+            'success': False,
+            'error': 409,
+            'message': 'Conflict'
+        }), 409
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -0,0 +1,116 @@
+"""
+Question change feed, streamed as Server-Sent Events.
+
+POST /questions and DELETE /questions/<id> publish `created` and `deleted`
+events here once their transaction commits (in write-behind mode, once the
+worker applies them). GET /questions/changes streams them to every
+connected client, so list views can patch what they show instead of
+refetching pages.
+
+The last CHANGE_FEED_SIZE events are kept in memory. Event ids are this
+process's start time plus a sequence number, and a client that reconnects
+with Last-Event-ID gets every event it missed while they are still
+buffered. If they are not (the client fell too far behind, or the id comes
+from another process or an earlier run) it gets a `reset` event instead and
+should reload what it shows. Streams end after CHANGE_FEED_TIMEOUT seconds,
+so a connection does not hold a server thread forever; EventSource
+reconnects on its own and resumes from the last id it saw.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+RESET = 'reset'
+# How long EventSource waits before reconnecting, in milliseconds.
+RETRY_MS = 2000
+
+
+class ChangeFeed:
+    def __init__(self, size=1000, timeout=300, keepalive=15):
+        self.size = size
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.epoch = format(time.time_ns(), 'x')
+        self._events = deque(maxlen=size)
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def publish(self, event, data):
+        """Buffer an event and wake every stream. Returns its id."""
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, event, json.dumps(data)))
+            self._condition.notify_all()
+            return f'{self.epoch}-{self._sequence}'
+
+    def question_created(self, question_id, item):
+        return self.publish('created', {
+            'id': question_id,
+            'question': item['question'],
+            'answer': item['answer'],
+            'category': item['category'],
+            'difficulty': item['difficulty']
+        })
+
+    def question_deleted(self, question_id):
+        return self.publish('deleted', {'id': question_id})
+
+    def _position(self, last_event_id):
+        # The sequence number to resume after, or None when `last_event_id`
+        # is not one of ours. Called with the condition held.
+        if last_event_id is None:
+            return self._sequence
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        return sequence if sequence <= self._sequence else None
+
+    def _since(self, position):
+        # Buffered events after `position`, or None when some of them have
+        # already been evicted. Called with the condition held.
+        oldest = self._events[0][0] if self._events else self._sequence + 1
+        if position < oldest - 1:
+            return None
+        return list(itertools.islice(
+            self._events, position - oldest + 1, None))
+
+    def _message(self, sequence, event, data):
+        return f'id: {self.epoch}-{sequence}\nevent: {event}\ndata: {data}\n\n'
+
+    def stream(self, last_event_id=None):
+        """
+        Generator of SSE messages for the events after `last_event_id`, or
+        from now on without one. Sends a comment every `keepalive` seconds
+        while idle, and stops after `timeout` seconds.
+        """
+        with self._condition:
+            position = self._position(last_event_id)
+        yield f'retry: {RETRY_MS}\n\n'
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                events = None if position is None else self._since(position)
+                if events == []:
+                    self._condition.wait(
+                        max(min(self.keepalive, deadline - time.monotonic()),
+                            0))
+                    events = self._since(position)
+                if events is None:
+                    # Missed events; carry on from the newest one.
+                    position = self._sequence
+                    messages = [self._message(position, RESET, '{}')]
+                else:
+                    messages = [self._message(*event) for event in events]
+                    if events:
+                        position = events[-1][0]
+
+            if messages:
+                yield ''.join(messages)
+            elif time.monotonic() >= deadline:
+                return
+            else:
+                yield ': keepalive\n\n'
@@ -0,0 +1,73 @@
+"""
+Response formats for the question listings, chosen from the Accept header.
+
+- application/json, the default, for every client that asks for anything
+  else or nothing at all;
+- application/vnd.trivia.columnar+json, which sends `questions` as one
+  array per field instead of one object per question, so the field names
+  are not repeated for every row;
+- application/msgpack (or application/x-msgpack), and its columnar variant
+  application/vnd.trivia.columnar+msgpack.
+"""
+import msgpack
+from flask import current_app, jsonify, request
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.trivia.columnar+json'
+MSGPACK = 'application/msgpack'
+COLUMNAR_MSGPACK = 'application/vnd.trivia.columnar+msgpack'
+MSGPACK_ALIASES = {'application/x-msgpack': MSGPACK}
+
+
+# JSON first, so that */* gets it.
+FORMATS = [JSON, COLUMNAR_JSON, MSGPACK, COLUMNAR_MSGPACK, *MSGPACK_ALIASES]
+
+
+def negotiate():
+    """The response format for this request's Accept header."""
+    mimetype = request.accept_mimetypes.best_match(FORMATS, default=JSON)
+    return MSGPACK_ALIASES.get(mimetype, mimetype)
+
+
+def columnar(payload, fields, key='questions'):
+    """
+    `payload` with its `key` list of objects turned into an object of
+    parallel arrays, one per name in `fields`. The arrays are there even
+    when the list is empty, so an empty page keeps its columns.
+    """
+    rows = payload.get(key)
+    if not isinstance(rows, list):
+        return payload
+    return dict(payload, **{
+        key: {field: [row.get(field) for row in rows] for field in fields}})
+
+
+def _string_keys(value):
+    # JSON turns integer keys (the categories map) into strings; do the
+    # same for MessagePack, whose decoders reject other keys by default.
+    if isinstance(value, dict):
+        return {str(key): _string_keys(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_string_keys(item) for item in value]
+    return value
+
+
+def render(payload, fields, status=200):
+    """
+    Response for `payload` in the negotiated format. `fields` are the keys
+    of each question, the columns of the columnar formats.
+    """
+    mimetype = negotiate()
+    if mimetype in (COLUMNAR_JSON, COLUMNAR_MSGPACK):
+        payload = columnar(payload, fields)
+
+    if mimetype in (MSGPACK, COLUMNAR_MSGPACK):
+        response = current_app.response_class(
+            msgpack.packb(_string_keys(payload), use_bin_type=True),
+            mimetype=mimetype)
+    else:
+        response = jsonify(payload)
+        response.mimetype = mimetype
+    response.status_code = status
+    response.vary.add('Accept')
+    return response
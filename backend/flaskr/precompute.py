@@ -0,0 +1,449 @@
+"""
+Quiz and search tables rebuilt in worker processes.
+
+With PRECOMPUTE_WORKERS set, the CPU-heavy structures derived from the
+questions table are built in a process pool instead of in request threads:
+
+- the (category, difficulty) buckets QuestionPool samples from, and
+- a trigram index over question text. POST /questions/search uses it to
+  narrow its ILIKE to the few questions that can match.
+
+A background thread reads the rows once and hands them to the pool. The
+trigram index is built over PRECOMPUTE_WORKERS slices of the rows in
+parallel, so a rebuild after a bulk import uses every core. Each worker
+writes its result as one flat array of ids into a shared memory block and
+returns only the block name and a small header, so large results are never
+pickled.
+
+The finished tables are published as one named shared memory segment: a
+JSON header followed by every id array. The name is derived from
+models.questions_revision(), so any app process on the host that reads the
+same revision attaches to the segment and reads its tables in place
+instead of building them again. The process that created a segment unlinks
+it when it publishes the next one; processes attached to it keep their
+mapping until they move on. Python 3.7 has no
+multiprocessing.shared_memory; there the arrays come back as bytes and
+each process keeps its own tables.
+
+Requests always use the last published tables and never wait for a
+rebuild. Rebuilds start after local writes (models.on_questions_changed)
+and every PRECOMPUTE_INTERVAL seconds. Searches only use the index while
+questions_version() is unchanged since the build and, checked at most once
+every `ttl` seconds, questions_revision() too, so writes by other
+processes, including edits and revived questions, stop the index from
+being used within `ttl` seconds.
+"""
+import array
+import atexit
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python 3.7
+    shared_memory = None
+
+from models import (Question, db, on_questions_changed, question_rows,
+                    questions_revision, questions_version)
+
+from .worker import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+# Stands for a NULL difficulty in the bucket header.
+NO_DIFFICULTY = -1
+# Beyond this many candidates an IN list costs more than the index saves.
+MAX_CANDIDATES = 1000
+# Part of every segment name; change it when the segment layout changes.
+SEGMENT_FORMAT = 1
+ID_SIZE = array.array('q').itemsize
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _publish(ids):
+    """
+    Hand an array of ids back to the parent process: (block name, size) of
+    a shared memory block holding it, or (None, bytes) without one.
+    """
+    data = array.array('q', ids)
+    size = len(data) * data.itemsize
+    if shared_memory is None or not size:
+        return None, data.tobytes()
+    block = shared_memory.SharedMemory(create=True, size=size)
+    block.buf[:size] = memoryview(data).cast('B')
+    block.close()
+    # The parent unlinks the block once it has read it; keep this worker's
+    # resource tracker from unlinking it too when the worker exits.
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return block.name, size
+
+
+def _receive(handle):
+    """Copy an array published by _publish and free its block."""
+    name, payload = handle
+    data = array.array('q')
+    if name is None:
+        data.frombytes(payload)
+        return data
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        with block.buf[:payload] as view:
+            data.frombytes(view)
+    finally:
+        block.close()
+        block.unlink()
+    return data
+
+
+def _discard(handle):
+    name, _ = handle
+    if name is not None:
+        block = shared_memory.SharedMemory(name=name)
+        block.close()
+        block.unlink()
+
+
+def _flatten(groups):
+    header = {}
+    ids = []
+    for key, members in groups.items():
+        header[key] = (len(ids), len(members))
+        ids.extend(members)
+    return header, _publish(ids)
+
+
+def build_buckets(rows):
+    """Worker: group (id, category, difficulty) rows into buckets."""
+    groups = {}
+    for question_id, category, difficulty in sorted(rows):
+        key = (category,
+               NO_DIFFICULTY if difficulty is None else difficulty)
+        groups.setdefault(key, []).append(question_id)
+    return _flatten(groups)
+
+
+def build_search_partition(rows):
+    """Worker: trigram posting lists for a slice of (id, question) rows."""
+    groups = {}
+    for question_id, text in rows:
+        for gram in trigrams(text or ''):
+            groups.setdefault(gram, []).append(question_id)
+    return _flatten(groups)
+
+
+def segment_name(revision):
+    """Shared memory name of the tables built at `revision`."""
+    digest = hashlib.sha1(
+        repr((SEGMENT_FORMAT, revision)).encode('utf-8')).hexdigest()
+    return f'trivia-{digest[:20]}'
+
+
+if shared_memory is not None:
+    class _Segment(shared_memory.SharedMemory):
+        # Whether this process created the segment rather than attached.
+        created = False
+
+        def __del__(self):
+            # Views over the mapping may outlive this object; the mapping
+            # is released with the last of them, so only the descriptor is
+            # closed here.
+            if getattr(self, '_fd', -1) >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+def _header_offset(length):
+    # The ids start at the first multiple of ID_SIZE after the header.
+    return -(-(ID_SIZE + length) // ID_SIZE) * ID_SIZE
+
+
+def _create_segment(name, header, data):
+    """
+    Publish `header` and the ids in `data` as segment `name`. Returns the
+    segment, or None when another process already created it.
+    """
+    body = json.dumps(header).encode('utf-8')
+    offset = _header_offset(len(body))
+    size = offset + len(data) * ID_SIZE
+    try:
+        segment = _Segment(name=name, create=True, size=size)
+    except FileExistsError:
+        return None
+    segment.created = True
+    segment.buf[ID_SIZE:ID_SIZE + len(body)] = body
+    if data:
+        segment.buf[offset:size] = memoryview(data).cast('B')
+    # Written last: a segment without it is still being filled.
+    struct.pack_into('q', segment.buf, 0, len(body))
+    return segment
+
+
+def _unlink_segment(segment):
+    # An attaching process that shares this process's resource tracker may
+    # have unregistered the name; register it again so unlink() does not
+    # unregister a name the tracker has forgotten.
+    resource_tracker.register(segment._name, 'shared_memory')
+    segment.unlink()
+
+
+def _open_segment(name):
+    """Attach to the existing segment `name`, or return None."""
+    try:
+        segment = _Segment(name=name)
+    except FileNotFoundError:
+        return None
+    # Attaching registers the segment with this process's resource
+    # tracker, which would unlink it when the process exits.
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def _read_segment(segment):
+    """(header, ids) of a segment, or None while it is being filled."""
+    length, = struct.unpack_from('q', segment.buf, 0)
+    if not length:
+        return None
+    header = json.loads(bytes(segment.buf[ID_SIZE:ID_SIZE + length]))
+    offset = _header_offset(length)
+    return header, segment.buf[
+        offset:offset + header['size'] * ID_SIZE].cast('q')
+
+
+class PublishedTables:
+    """
+    One consistent build: buckets as id views, and for each trigram the id
+    views of every row slice that has it. With a `segment`, the views point
+    into its shared memory.
+    """
+
+    def __init__(self, version, revision, header, ids, segment=None):
+        self.version = version
+        self.revision = revision
+        self.buckets = {
+            (category, None if difficulty == NO_DIFFICULTY else difficulty):
+            ids[offset:offset + length]
+            for category, difficulty, offset, length in header['buckets']}
+        self.postings = {}
+        for partition in header['postings']:
+            for gram, (offset, length) in partition.items():
+                self.postings.setdefault(gram, []).append(
+                    ids[offset:offset + length])
+        self.count = header['count']
+        self.segment = segment
+        # When questions_revision() was last found unchanged, and whether
+        # it has been found changed since.
+        self.checked_at = time.monotonic()
+        self.stale = False
+
+    @classmethod
+    def attach(cls, version, revision):
+        """The tables another process published for `revision`, or None."""
+        if shared_memory is None:
+            return None
+        segment = _open_segment(segment_name(revision))
+        contents = segment and _read_segment(segment)
+        if not contents:
+            return None
+        return cls(version, revision, *contents, segment)
+
+    @classmethod
+    def publish(cls, version, revision, buckets, partitions):
+        """
+        Tables from the workers' (header, ids) results for the buckets and
+        each search partition, published as a segment where possible.
+        """
+        bucket_header, data = buckets
+        header = {
+            'buckets': [[category, difficulty, offset, length]
+                        for (category, difficulty), (offset, length)
+                        in bucket_header.items()],
+            'postings': [],
+            'count': len(data)}
+        for partition_header, partition_ids in partitions:
+            base = len(data)
+            header['postings'].append({
+                gram: [base + offset, length]
+                for gram, (offset, length) in partition_header.items()})
+            data.extend(partition_ids)
+        header['size'] = len(data)
+
+        if shared_memory is not None:
+            segment = _create_segment(segment_name(revision), header, data)
+            if segment is not None:
+                return cls(version, revision, *_read_segment(segment),
+                           segment)
+            # Another process published the same revision first.
+            tables = cls.attach(version, revision)
+            if tables is not None:
+                return tables
+        return cls(version, revision, header, memoryview(data))
+
+    def candidates(self, term):
+        """
+        Sorted ids of the questions whose text may contain `term`, or None
+        when the index cannot answer and the caller must scan instead.
+        """
+        # LIKE wildcards and escapes, and non-ASCII case folding, are left
+        # to the database.
+        if (len(term) < 3 or not term.isascii()
+                or any(char in term for char in '%_\\')):
+            return None
+        postings = sorted(
+            (self.postings.get(gram, ()) for gram in trigrams(term)),
+            key=lambda views: sum(len(view) for view in views))
+        found = None
+        for views in postings:
+            ids = set()
+            for view in views:
+                ids.update(view)
+            found = ids if found is None else found & ids
+            if not found:
+                break
+        if len(found) > MAX_CANDIDATES:
+            return None
+        return sorted(found)
+
+
+class Precomputer:
+    def __init__(self, workers, interval=60, ttl=60):
+        self.workers = workers
+        self.interval = interval
+        self.ttl = ttl
+        self._published = None
+        # The segment this process created last, unlinked once replaced
+        # and at exit.
+        self._created = None
+        self._unlink_registered = False
+        self._executor = None
+        self._worker = PeriodicWorker(
+            'precompute', self._rebuild_and_log, interval,
+            error='Could not precompute quiz tables')
+        on_questions_changed(self._worker.wake)
+
+    def current(self):
+        """The last published tables, or None before the first build."""
+        return self._published
+
+    def request_rebuild(self):
+        self._worker.wake()
+
+    def search_candidates(self, term):
+        """
+        Question ids that may match a search for `term`, or None when the
+        index cannot answer; must run inside an app context. An index older
+        than the last write in this process is never used, and one older
+        than another process's write is not used once questions_revision()
+        is checked, at most every `ttl` seconds.
+        """
+        published = self._published
+        if published is None or published.version != questions_version():
+            return None
+        candidates = published.candidates(term)
+        if candidates is not None and not self._unchanged(published):
+            return None
+        return candidates
+
+    def _unchanged(self, published):
+        if published.stale:
+            return False
+        now = time.monotonic()
+        if now - published.checked_at < self.ttl:
+            return True
+        if questions_revision() != published.revision:
+            published.stale = True
+            self.request_rebuild()
+            return False
+        published.checked_at = now
+        return True
+
+    def rebuild(self):
+        """
+        Publish tables for the current questions, attaching to the segment
+        of another process when it already built them; must run inside an
+        app context. Returns the number of questions.
+        """
+        version = questions_version()
+        try:
+            # Taken first: a write meanwhile makes the build look stale,
+            # never fresh.
+            revision = questions_revision()
+            current = self._published
+            if (current is not None and current.version == version
+                    and current.revision == revision):
+                current.checked_at = time.monotonic()
+                return current.count
+            tables = PublishedTables.attach(version, revision)
+            if tables is None:
+                rows = question_rows(db.session.query(
+                    Question.id, Question.category, Question.difficulty,
+                    Question.question).filter(
+                        Question.deleted_at.is_(None)).order_by(Question.id))
+        finally:
+            db.session.remove()
+        if tables is None:
+            tables = self._build(version, revision, rows)
+
+        if (self._created is not None
+                and self._created.name != segment_name(revision)):
+            _unlink_segment(self._created)
+            self._created = None
+        if tables.segment is not None and tables.segment.created:
+            if not self._unlink_registered:
+                atexit.register(self._unlink_at_exit)
+                self._unlink_registered = True
+            self._created = tables.segment
+        self._published = tables
+        return tables.count
+
+    def _build(self, version, revision, rows):
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        buckets = self._executor.submit(
+            build_buckets, [row[:3] for row in rows])
+        texts = [(row[0], row[3]) for row in rows]
+        partitions = [
+            self._executor.submit(
+                build_search_partition, texts[partition::self.workers])
+            for partition in range(self.workers)]
+
+        futures = [buckets] + partitions
+        wait(futures)
+        failed = [future for future in futures if future.exception()]
+        if failed:
+            # Free what the other workers published before giving up.
+            for future in futures:
+                if not future.exception():
+                    _discard(future.result()[1])
+            raise failed[0].exception()
+
+        header, handle = buckets.result()
+        return PublishedTables.publish(
+            version, revision, (header, _receive(handle)),
+            [(header, _receive(handle)) for header, handle
+             in (future.result() for future in partitions)])
+
+    def _unlink_at_exit(self):
+        if self._created is not None:
+            _unlink_segment(self._created)
+            self._created = None
+
+    def start(self, app):
+        """Start the background rebuilds for `app` unless running."""
+        self._worker.start(app)
+
+    def _rebuild_and_log(self):
+        started = time.perf_counter()
+        count = self.rebuild()
+        logger.debug('Precomputed quiz and search tables for %d '
+                     'questions in %.1f ms', count,
+                     (time.perf_counter() - started) * 1000)
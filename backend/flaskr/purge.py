@@ -0,0 +1,66 @@
+"""
+Background purge of soft-deleted questions.
+
+DELETE /questions/<id> only sets `deleted_at`, which every read filters on.
+The rows themselves are removed here, off the request path: every
+PURGE_INTERVAL seconds, questions deleted more than PURGE_RETENTION seconds
+ago are deleted in batches of PURGE_BATCH_SIZE, one transaction per batch.
+The same job removes idempotency keys older than IDEMPOTENCY_KEY_TTL.
+Both can be run from cron with `flask purge-deleted-questions`.
+"""
+import logging
+from datetime import timedelta
+
+from models import db, purge_deleted_questions, purge_idempotency_keys
+
+from .worker import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+
+class DeletedQuestionPurger:
+    def __init__(self, retention=86400, interval=3600, batch_size=1000,
+                 key_ttl=86400):
+        self.retention = retention
+        self.key_ttl = key_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self._worker = PeriodicWorker(
+            'question-purge', self._purge_and_log, interval,
+            error='Could not purge deleted questions', run_at_start=False)
+
+    def purge(self):
+        """Purge once; must run inside an app context."""
+        try:
+            return purge_deleted_questions(
+                older_than=timedelta(seconds=self.retention),
+                batch_size=self.batch_size)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+    def expire_idempotency_keys(self):
+        """Remove expired idempotency keys; must run inside an app context."""
+        try:
+            return purge_idempotency_keys(
+                older_than=timedelta(seconds=self.key_ttl),
+                batch_size=self.batch_size)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+    def start(self, app):
+        """Start the background purge for `app` unless it is running."""
+        self._worker.start(app)
+
+    def _purge_and_log(self):
+        purged = self.purge()
+        if purged:
+            logger.info(f'Purged {purged} deleted questions')
+        expired = self.expire_idempotency_keys()
+        if expired:
+            logger.info(f'Removed {expired} expired idempotency keys')
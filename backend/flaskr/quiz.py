@@ -0,0 +1,271 @@
+"""
+Quiz question selection.
+
+Questions are grouped into (category, difficulty) buckets. For each kind of
+quiz request (category, difficulty range, adaptive target) an alias table is
+built once over the buckets that request may draw from, weighted by bucket
+size and difficulty weight. Drawing a question is then O(1): one alias table
+lookup to pick a bucket and one uniform pick inside it, instead of loading and
+shuffling every candidate row for each step of the quiz.
+"""
+import random
+import threading
+import time
+
+from models import Question, db, question_rows, questions_version
+
+# How many draws may land on an already asked question before we fall back to
+# scanning the remaining candidates.
+MAX_REJECTIONS = 32
+# Selections come from request bodies; past this many cached alias tables
+# the cache starts over instead of growing with every distinct selection.
+MAX_ALIAS_TABLES = 256
+# Difficulties the UI offers; adaptive targets are kept within them.
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, O(1) to sample."""
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = float(sum(weights))
+        self.items = list(items)
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def sample(self, rng=random):
+        i = rng.randrange(len(self.items))
+        if rng.random() < self.prob[i]:
+            return self.items[i]
+        return self.items[self.alias[i]]
+
+
+class QuizSelection:
+    """
+    Which questions a quiz request may draw from and how to weight them.
+
+    `difficulty` pins a single difficulty, `min_difficulty`/`max_difficulty`
+    bound a range and `target_difficulty` weights questions by how close they
+    are to the target, so an adaptive client can move the target up or down
+    as the player answers.
+    """
+
+    def __init__(self, category=None, min_difficulty=None,
+                 max_difficulty=None, target_difficulty=None):
+        self.category = category
+        self.min_difficulty = min_difficulty
+        self.max_difficulty = max_difficulty
+        self.target_difficulty = target_difficulty
+
+    @property
+    def key(self):
+        return (self.category, self.min_difficulty, self.max_difficulty,
+                self.target_difficulty)
+
+    @property
+    def filters_difficulty(self):
+        return (self.min_difficulty is not None
+                or self.max_difficulty is not None
+                or self.target_difficulty is not None)
+
+    def allows(self, category, difficulty):
+        if self.category is not None and category != self.category:
+            return False
+        if difficulty is None:
+            return not self.filters_difficulty
+        if (self.min_difficulty is not None
+                and difficulty < self.min_difficulty):
+            return False
+        if (self.max_difficulty is not None
+                and difficulty > self.max_difficulty):
+            return False
+        return True
+
+    def weight(self, difficulty):
+        if self.target_difficulty is None:
+            return 1.0
+        return 1.0 / (1 + abs(difficulty - self.target_difficulty)) ** 2
+
+
+def _optional_int(data, name):
+    value = data.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name} must be an integer')
+    return value
+
+
+def _optional_number(data, name):
+    value = data.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f'{name} must be a number')
+    return value
+
+
+def parse_selection(data):
+    """
+    Build a QuizSelection from a /quizzes request body.
+
+    Raises ValueError when the body is malformed.
+    """
+    quiz_category = data.get('quiz_category')
+    category = None
+    if quiz_category is not None:
+        if not isinstance(quiz_category, dict):
+            raise ValueError('quiz_category must be an object')
+        category = int(quiz_category.get('id') or 0) or None
+
+    min_difficulty = _optional_int(data, 'min_difficulty')
+    max_difficulty = _optional_int(data, 'max_difficulty')
+    difficulty = _optional_int(data, 'difficulty')
+    if difficulty is not None:
+        min_difficulty = max_difficulty = difficulty
+
+    # The target is part of the alias table cache key, so it is rounded to
+    # a whole difficulty in range rather than kept as any number sent.
+    target_difficulty = _optional_number(data, 'target_difficulty')
+    if target_difficulty is not None:
+        target_difficulty = min(max(round(target_difficulty), MIN_DIFFICULTY),
+                                MAX_DIFFICULTY)
+
+    return QuizSelection(
+        category=category,
+        min_difficulty=min_difficulty,
+        max_difficulty=max_difficulty,
+        target_difficulty=target_difficulty)
+
+
+class QuestionPool:
+    """
+    In-memory (category, difficulty) -> [question ids] buckets plus the alias
+    tables built over them.
+
+    The buckets are rebuilt from a single id/category/difficulty query when a
+    Question is committed through the ORM (see models.questions_version) or
+    after `ttl` seconds, which covers rows changed outside the app.
+
+    With a `precomputer` (see precompute.py) the buckets come from its last
+    published build instead and are never rebuilt in the request thread;
+    only before its first build does the pool load them itself.
+    """
+
+    def __init__(self, ttl=60, precomputer=None):
+        self.ttl = ttl
+        self.precomputer = precomputer
+        self._lock = threading.Lock()
+        self._buckets = None
+        self._tables = {}
+        self._version = None
+        self._built_at = 0
+        self._published = None
+
+    def invalidate(self):
+        with self._lock:
+            self._buckets = None
+            self._tables = {}
+            self._published = None
+        if self.precomputer is not None:
+            self.precomputer.request_rebuild()
+
+    def _stale(self):
+        return (self._buckets is None
+                or self._version != questions_version()
+                or time.monotonic() - self._built_at > self.ttl)
+
+    def _load(self):
+        version = questions_version()
+        rows = question_rows(db.session.query(
+            Question.id, Question.category, Question.difficulty).filter(
+                Question.deleted_at.is_(None)).order_by(Question.id))
+        buckets = {}
+        for question_id, category, difficulty in rows:
+            buckets.setdefault((category, difficulty), []).append(question_id)
+        return version, buckets
+
+    def _refresh(self):
+        # Called with the lock held.
+        published = (self.precomputer.current()
+                     if self.precomputer is not None else None)
+        if published is not None:
+            if published is not self._published:
+                self._published = published
+                self._buckets = published.buckets
+                self._tables = {}
+        elif self._stale():
+            self._version, self._buckets = self._load()
+            self._tables = {}
+            self._built_at = time.monotonic()
+
+    def _table(self, selection):
+        # The tables dict is shared by every request thread, so it is only
+        # read and changed with the lock held. The buckets and alias tables
+        # themselves are never modified once built.
+        with self._lock:
+            self._refresh()
+            buckets, tables = self._buckets, self._tables
+            key = selection.key
+            if key not in tables:
+                if len(tables) >= MAX_ALIAS_TABLES:
+                    tables.clear()
+                chosen = [bucket for bucket in buckets
+                          if selection.allows(*bucket)]
+                weights = [
+                    len(buckets[bucket]) * selection.weight(bucket[1] or 0)
+                    for bucket in chosen]
+                tables[key] = AliasTable(chosen, weights) if chosen else None
+            table = tables[key]
+        return buckets, table
+
+    def draw_many(self, selection, count, exclude=()):
+        """
+        Return up to `count` distinct question ids for `selection`, none of
+        them in `exclude`.
+        """
+        buckets, table = self._table(selection)
+        if table is None:
+            return []
+
+        seen = set(exclude)
+        drawn = []
+        rejections = 0
+        while len(drawn) < count and rejections < MAX_REJECTIONS:
+            question_id = random.choice(buckets[table.sample()])
+            if question_id in seen:
+                rejections += 1
+                continue
+            seen.add(question_id)
+            drawn.append(question_id)
+
+        if len(drawn) < count:
+            # Most of the allowed questions have been used, so rejection
+            # sampling would keep missing. Fall back to a weighted draw
+            # without replacement over what is left.
+            remaining = [(question_id, selection.weight(bucket[1] or 0))
+                         for bucket in table.items
+                         for question_id in buckets[bucket]
+                         if question_id not in seen]
+            while remaining and len(drawn) < count:
+                index = random.choices(
+                    range(len(remaining)),
+                    weights=[weight for _, weight in remaining])[0]
+                drawn.append(remaining.pop(index)[0])
+
+        return drawn
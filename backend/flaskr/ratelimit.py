@@ -0,0 +1,159 @@
+"""
+Token bucket rate limiting for the expensive endpoints.
+
+Each (endpoint, client) pair gets a bucket holding up to `capacity` tokens
+that refills at `capacity / period` tokens per second; a request takes one
+token or is refused with the time until the next token. Buckets are refilled
+lazily when they are touched, so an idle client costs nothing.
+
+Clients are identified by their `X-API-Key` header when the key has its own
+quota in RATELIMIT_KEY_RULES, and by IP address otherwise. Buckets live in
+process memory by default; set RATELIMIT_STORAGE_URL to a redis:// URL to
+share them between workers (needs the optional `redis` package).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+
+def parse_rule(rule):
+    """
+    Parse '30/minute' into (capacity, tokens per second).
+
+    Raises ValueError for malformed rules.
+    """
+    if not isinstance(rule, str):
+        raise ValueError(f'Invalid rate limit rule: {rule!r}')
+    count, _, period = rule.partition('/')
+    period = period.strip()
+    try:
+        capacity = int(count)
+    except ValueError:
+        capacity = 0
+    if capacity <= 0 or period not in PERIODS:
+        raise ValueError(f'Invalid rate limit rule: {rule!r}')
+    return capacity, capacity / PERIODS[period]
+
+
+def parse_rules(rules):
+    """
+    Parse {endpoint: rule} into {endpoint: (capacity, tokens per second)}.
+
+    Raises ValueError when `rules` is not such a mapping.
+    """
+    if not isinstance(rules, dict):
+        raise ValueError(
+            f'Rate limit rules must map endpoints to rules: {rules!r}')
+    return {endpoint: parse_rule(rule) for endpoint, rule in rules.items()}
+
+
+class MemoryBackend:
+    """
+    Buckets in an LRU ordered dict of key -> [tokens, last refill time].
+    The least recently used buckets are dropped beyond `max_buckets`, which
+    bounds memory under address scanning; a dropped bucket was idle long
+    enough that starting it full again is harmless.
+    """
+
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Take a token; return (allowed, seconds until one is available)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(capacity), now]
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0
+            return False, (1 - bucket[0]) / rate
+
+
+# Refill and take atomically inside Redis so concurrent workers cannot both
+# spend the last token.
+REDIS_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """Buckets in Redis hashes, shared by every worker using the server."""
+
+    def __init__(self, url, prefix='trivia:ratelimit:'):
+        import redis
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(REDIS_TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        allowed, tokens = self._take(
+            keys=[self.prefix + key], args=[capacity, rate, time.time()])
+        if allowed:
+            return True, 0
+        return False, (1 - float(tokens)) / rate
+
+
+class RateLimiter:
+    def __init__(self, rules, key_rules=None, backend=None):
+        self.rules = parse_rules(rules)
+        key_rules = key_rules or {}
+        if not isinstance(key_rules, dict):
+            raise ValueError(
+                f'Key rate limits must map API keys to rules: {key_rules!r}')
+        self.key_rules = {api_key: parse_rules(endpoint_rules)
+                          for api_key, endpoint_rules in key_rules.items()}
+        self.backend = backend or MemoryBackend()
+
+    def check(self, endpoint, remote_addr, api_key=None):
+        """
+        Take a token for this request. Returns None when it may proceed, or
+        the number of whole seconds to wait before retrying.
+        """
+        rule = self.key_rules.get(api_key, {}).get(endpoint)
+        if rule is not None:
+            client = f'key:{api_key}'
+        else:
+            rule = self.rules.get(endpoint)
+            client = f'ip:{remote_addr}'
+        if rule is None:
+            return None
+
+        capacity, rate = rule
+        allowed, retry_after = self.backend.take(
+            f'{endpoint}:{client}', capacity, rate)
+        if allowed:
+            return None
+        return max(1, math.ceil(retry_after))
@@ -0,0 +1,296 @@
+"""
+Server-side answer checking and per-category leaderboards.
+
+Answers are compared after normalization (accents stripped, case-folded,
+punctuation dropped, whitespace collapsed, leading articles removed), so
+"the  Beatles!" matches "Beatles". Numbers and answers under four characters
+must then match exactly. Otherwise a guess also counts when it contains every
+word of the answer plus at most one more that is not an answer itself ("Dr.
+Maya Angelou", but not "Uruguay Brazil"), or when it is a close enough
+misspelling by difflib's similarity ratio. Normalized answers
+are kept in memory, rebuilt from one query whenever questions change here
+and at least every QUIZ_POOL_TTL seconds, which covers other processes.
+
+The first correct answer from a named player to a question adds a point to
+the leaderboard of the question's category and to the overall board
+(category 0); answering the same question again adds nothing. Boards and
+the answered questions are kept in memory, so scoring and ranking cost no
+database access. Score changes are written back in one batched transaction
+every LEADERBOARD_FLUSH_INTERVAL seconds, as increments, together with the
+(player, question) pairs they came from: a pair another process already
+wrote is skipped, so several worker processes can share the tables. The
+boards are reloaded after each write to pick up the other processes'
+scores.
+"""
+import atexit
+import bisect
+import difflib
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from models import (LeaderboardScore, Question, ScoredAnswer,
+                    add_leaderboard_scores, add_scored_answers, db,
+                    question_rows, questions_version)
+
+from .worker import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+ALL_CATEGORIES = 0
+ARTICLES = {'a', 'an', 'the'}
+PUNCTUATION = re.compile(r'[^\w\s]')
+# Words a guess may add to the answer; more would let a guess list several
+# candidates.
+MAX_EXTRA_WORDS = 1
+
+
+def normalize_answer(text):
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = PUNCTUATION.sub(' ', text.casefold()).split()
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def answers_match(guess, answer, threshold=0.85):
+    """Whether the raw `guess` is accepted for normalized `answer`."""
+    normalized = normalize_answer(guess)
+    if not normalized or not answer:
+        return False
+    if normalized == answer:
+        return True
+    # Numbers and very short answers must be exact; one typo changes them.
+    if answer.isdigit() or len(answer) < 4:
+        return False
+    if contains_answer(guess, answer):
+        return True
+    return difflib.SequenceMatcher(
+        None, normalized, answer).ratio() >= threshold
+
+
+def contains_answer(guess, answer):
+    """
+    Whether raw `guess` has every word of normalized `answer` plus at most
+    MAX_EXTRA_WORDS others. An extra word may not be an answer itself:
+    numbers and capitalized words ("Uruguay Brazil") are refused, while
+    abbreviations such as "Dr." are allowed.
+    """
+    answer_words = set(answer.split())
+    found, extra = set(), 0
+    for token in str(guess).split():
+        words = normalize_answer(token).split()
+        if set(words) <= answer_words:
+            found.update(words)
+            continue
+        if words[0] in ARTICLES and len(words) == 1:
+            continue
+        extra += len(words)
+        if (any(char.isdigit() for char in token)
+                or (token[0].isupper() and not token.endswith('.'))):
+            return False
+    return found == answer_words and extra <= MAX_EXTRA_WORDS
+
+
+class AnswerKey:
+    """
+    question id -> (normalized answer, answer, category), for live questions.
+    Rebuilt after local writes and when older than `ttl` seconds.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._answers = None
+        self._version = None
+        self._built_at = None
+
+    def get(self, question_id):
+        with self._lock:
+            if (self._answers is None
+                    or self._version != questions_version()
+                    or time.monotonic() - self._built_at > self.ttl):
+                self._version = questions_version()
+                self._built_at = time.monotonic()
+                rows = question_rows(db.session.query(
+                    Question.id, Question.answer, Question.category).filter(
+                        Question.deleted_at.is_(None)).order_by(Question.id))
+                self._answers = {
+                    question_id: (normalize_answer(answer), answer, category)
+                    for question_id, answer, category in rows}
+            return self._answers.get(question_id)
+
+
+class Leaderboard:
+    """Scores for one category, sorted by score, then player name."""
+
+    def __init__(self):
+        self.scores = {}
+        self._entries = []
+
+    def add(self, player, points):
+        score = self.scores.get(player, 0)
+        if player in self.scores:
+            del self._entries[bisect.bisect_left(
+                self._entries, (-score, player))]
+        score += points
+        self.scores[player] = score
+        bisect.insort(self._entries, (-score, player))
+        return score
+
+    def rank(self, player):
+        if player not in self.scores:
+            return None
+        return bisect.bisect_left(
+            self._entries, (-self.scores[player], player)) + 1
+
+    def top(self, limit):
+        return [{'rank': rank, 'player': player, 'score': -score}
+                for rank, (score, player)
+                in enumerate(self._entries[:limit], start=1)]
+
+
+class Leaderboards:
+    def __init__(self, flush_interval=30):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._boards = None
+        self._scored = None
+        # (player, question id) -> category id, for answers not written yet.
+        self._pending = {}
+        self._worker = PeriodicWorker(
+            'leaderboard-flush', self._flush_and_refresh, flush_interval,
+            error='Could not save leaderboard scores', run_at_start=False)
+
+    def _load(self):
+        # Called with the lock held, inside an app context.
+        if self._boards is None:
+            self._boards, self._scored = self._build(*self._read())
+
+    @staticmethod
+    def _read():
+        return (LeaderboardScore.query.all(),
+                db.session.query(ScoredAnswer.player,
+                                 ScoredAnswer.question_id).all())
+
+    def _build(self, rows, answers):
+        # Called with the lock held: the stored scores and answers plus the
+        # ones not written yet.
+        boards = {}
+        scores = [(row.category_id, row.player, row.score) for row in rows]
+        scores.extend(
+            (category_id, player, points) for (category_id, player), points
+            in self._increments(self._pending).items())
+        for category_id, player, points in scores:
+            board = boards.get(category_id)
+            if board is None:
+                board = boards[category_id] = Leaderboard()
+            board.add(player, points)
+        scored = {tuple(answer) for answer in answers}
+        scored.update(self._pending)
+        return boards, scored
+
+    @staticmethod
+    def _increments(answers):
+        """{(player, question id): category id} -> score increments."""
+        increments = {}
+        for (player, _), category_id in answers.items():
+            for board_id in {category_id, ALL_CATEGORIES}:
+                key = (board_id, player)
+                increments[key] = increments.get(key, 0) + 1
+        return increments
+
+    def _board(self, category_id):
+        board = self._boards.get(category_id)
+        if board is None:
+            board = self._boards[category_id] = Leaderboard()
+        return board
+
+    def score(self, player, category_id, question_id):
+        """
+        Add a point to `player` on `category_id` and the overall board,
+        unless `player` already scored `question_id`. Returns (score, rank)
+        on the category board.
+        """
+        with self._lock:
+            self._load()
+            key = (player, question_id)
+            if key not in self._scored:
+                self._scored.add(key)
+                self._pending[key] = category_id
+                for board_id in {category_id, ALL_CATEGORIES}:
+                    self._board(board_id).add(player, 1)
+            board = self._board(category_id)
+            return board.scores.get(player, 0), board.rank(player)
+
+    def standing(self, player, category_id):
+        """(score, rank) of `player` on `category_id`, or (0, None)."""
+        with self._lock:
+            self._load()
+            board = self._board(category_id)
+            return board.scores.get(player, 0), board.rank(player)
+
+    def top(self, category_id, limit=10):
+        with self._lock:
+            self._load()
+            board = self._boards.get(category_id)
+            return board.top(limit) if board else []
+
+    def flush(self):
+        """
+        Write pending answers and their score increments in one
+        transaction; must run inside an app context. Answers another
+        process already wrote add nothing. Returns the number of score rows
+        written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            new = add_scored_answers(pending)
+            increments = self._increments(
+                {key: pending[key] for key in new})
+            if increments:
+                add_leaderboard_scores(increments)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Keep the answers for the next flush.
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        finally:
+            db.session.remove()
+        return len(increments)
+
+    def refresh(self):
+        """
+        Reload the boards from the table, which other processes write to;
+        must run inside an app context.
+        """
+        try:
+            rows, answers = self._read()
+        finally:
+            db.session.remove()
+        with self._lock:
+            self._boards, self._scored = self._build(rows, answers)
+
+    def _flush_and_refresh(self):
+        self.flush()
+        self.refresh()
+
+    def start(self, app):
+        """Start flushing for `app` in the background unless running."""
+        if self._worker.start(app):
+            atexit.register(self._flush_at_exit, app)
+
+    def _flush_at_exit(self, app):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.warning(f'Could not save leaderboard scores: {e}')
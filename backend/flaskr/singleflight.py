@@ -0,0 +1,52 @@
+"""
+Request coalescing for identical concurrent reads.
+
+When several requests ask for the same thing at the same time (a burst on
+`GET /questions?page=1` after a cache expires), only the first one runs the
+query; the others wait for it and get the same result, or the same error.
+Nothing is cached: once the first call returns, the next request for that key
+runs the query again.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """
+        Return `function()`, sharing one call between every thread that asks
+        for the same `key` while it is running. The result is handed to all
+        of them, so it must not be mutated by the callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
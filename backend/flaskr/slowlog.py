@@ -0,0 +1,110 @@
+"""
+Opt-in slow query recorder.
+
+Hooks the SQLAlchemy engine's cursor events, times every statement and keeps
+the ones slower than a threshold in a bounded ring buffer, together with the
+route that issued them, their bound parameters and, optionally, the
+database's EXPLAIN output.
+"""
+import logging
+import time
+from collections import deque
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def _jsonable(parameters):
+    if isinstance(parameters, dict):
+        return {key: _jsonable(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_jsonable(value) for value in parameters]
+    if parameters is None or isinstance(parameters, (str, int, float, bool)):
+        return parameters
+    return repr(parameters)
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=100, explain=False, size=100):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self._entries = deque(maxlen=size)
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def entries(self):
+        """Recorded queries, newest first."""
+        return list(reversed(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info['slowlog_start'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        started = conn.info.pop('slowlog_start', None)
+        if started is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        entry = {
+            'statement': statement,
+            'parameters': _jsonable(parameters),
+            'duration_ms': round(duration_ms, 3),
+            'recorded_at': time.time(),
+            'route': None,
+            'method': None,
+            'endpoint': None,
+            'plan': None,
+        }
+        if has_request_context():
+            entry['route'] = request.path
+            entry['method'] = request.method
+            entry['endpoint'] = request.endpoint
+        if (self.explain and not executemany
+                and statement.lstrip().upper().startswith('SELECT')):
+            entry['plan'] = self._explain(conn, statement, parameters)
+
+        self._entries.append(entry)
+        logger.warning('Slow query (%.1f ms) on %s %s: %s %r',
+                       duration_ms, entry['method'], entry['route'],
+                       statement, parameters)
+
+    def _explain(self, conn, statement, parameters):
+        dialect = conn.dialect.name
+        prefix = EXPLAIN_PREFIXES.get(dialect, 'EXPLAIN ')
+        # A raw DBAPI cursor so the EXPLAIN itself is neither timed nor
+        # recorded. On PostgreSQL it runs inside a savepoint, so a failing
+        # EXPLAIN cannot abort the request's transaction.
+        cursor = conn.connection.cursor()
+        use_savepoint = dialect == 'postgresql'
+        try:
+            if use_savepoint:
+                cursor.execute('SAVEPOINT slowlog_explain')
+            cursor.execute(prefix + statement, parameters)
+            plan = [' '.join(str(column) for column in row)
+                    for row in cursor.fetchall()]
+            if use_savepoint:
+                cursor.execute('RELEASE SAVEPOINT slowlog_explain')
+            return plan
+        except Exception as e:
+            logger.warning(f'Could not EXPLAIN slow query: {e}')
+            if use_savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT slowlog_explain')
+            return None
+        finally:
+            cursor.close()
@@ -0,0 +1,73 @@
+"""
+Pre-serialized snapshots of the hottest read pages.
+
+A background thread builds the first SNAPSHOT_PAGES pages of
+`GET /questions` and every `GET /categories/<id>/questions` listing, encodes
+them once as JSON bytes and keeps the bytes, so requests for those pages are
+answered without touching the database or the JSON encoder.
+
+Snapshots are built at startup, rebuilt right after any commit that changes
+questions in this process (see models.on_questions_changed) and otherwise
+every SNAPSHOT_INTERVAL seconds, which covers writes made elsewhere. A
+snapshot older than the last local write is never served: until the rebuild
+finishes, requests fall back to the normal query path.
+"""
+import logging
+import threading
+import time
+
+from flask import jsonify
+
+from models import db, on_questions_changed, questions_version
+
+from .worker import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+
+class PageSnapshots:
+    def __init__(self, build, interval=60, debounce=0.2):
+        """
+        `build()` runs inside an app context and yields (key, payload)
+        pairs for every page to snapshot.
+        """
+        self.build = build
+        self.interval = interval
+        self.debounce = debounce
+        self._snapshots = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self._worker = PeriodicWorker(
+            'page-snapshots', self._warm_and_log, interval,
+            error='Could not warm page snapshots', debounce=debounce)
+        on_questions_changed(self._worker.wake)
+
+    def get(self, key):
+        """The snapshot bytes for `key`, or None when missing or stale."""
+        with self._lock:
+            if self._version != questions_version():
+                return None
+            return self._snapshots.get(key)
+
+    def warm(self):
+        """Rebuild every snapshot; must run inside an app context."""
+        version = questions_version()
+        try:
+            snapshots = {key: jsonify(payload).get_data()
+                         for key, payload in self.build()}
+        finally:
+            db.session.remove()
+        with self._lock:
+            self._snapshots = snapshots
+            self._version = version
+        return len(snapshots)
+
+    def start(self, app):
+        """Start the background warmer for `app` unless it is running."""
+        self._worker.start(app)
+
+    def _warm_and_log(self):
+        started = time.perf_counter()
+        count = self.warm()
+        logger.debug('Warmed %d page snapshots in %.1f ms', count,
+                     (time.perf_counter() - started) * 1000)
@@ -0,0 +1,68 @@
+"""
+Periodic background work on a daemon thread.
+
+The purger, page snapshots, precomputed tables, leaderboard flushes and the
+write-behind queue all run the same loop: call a task inside an app
+context, log it if it fails, then wait `interval` seconds or until woken
+(after a local write, for example) and call it again. Each one owns a
+PeriodicWorker; starting it twice is a no-op.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    def __init__(self, name, task, interval, error, debounce=0,
+                 run_at_start=True):
+        """
+        `task` takes no arguments and runs inside an app context; if it
+        raises, `error` and the exception are logged. With `debounce`, a
+        wake-up waits that many seconds more so a burst of writes is
+        handled once. Without `run_at_start`, the first call comes one
+        interval (or wake-up) after the start.
+        """
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.error = error
+        self.debounce = debounce
+        self.run_at_start = run_at_start
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        """Run the task now instead of at the end of the interval."""
+        self._wakeup.set()
+
+    def start(self, app):
+        """
+        Start the thread for `app` unless it is running. Returns whether
+        it was started.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(
+                target=self._run, args=(app,), name=self.name, daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, app):
+        if not self.run_at_start:
+            self._wait()
+        while True:
+            try:
+                with app.app_context():
+                    self.task()
+            except Exception as e:
+                logger.warning(f'{self.error}: {e}')
+            self._wait()
+
+    def _wait(self):
+        if self._wakeup.wait(self.interval) and self.debounce:
+            time.sleep(self.debounce)
+        self._wakeup.clear()
@@ -0,0 +1,266 @@
+"""
+Write-behind queue for question mutations.
+
+With WRITE_BEHIND enabled, POST /questions and DELETE /questions/<id> append
+the mutation to a local SQLite file in WAL mode and answer 202 right away. A
+background thread drains the queue, applying up to WRITE_BEHIND_BATCH_SIZE
+mutations to the main database per transaction, and records each outcome so
+clients can follow it at GET /mutations/<id>. Applied mutations are
+published to the question change feed (changes.py) after their commit.
+
+The file survives restarts: mutations left pending, or claimed by a worker
+that died before finishing them, are picked up again. A mutation picked up
+again may already have been applied, so replays are idempotent: a create
+finds its questions by content, and a delete of a question that is already
+gone succeeds. Several worker processes may share one file; each claims its
+batch inside an IMMEDIATE transaction, so no mutation is applied by two of
+them at once.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from models import db, insert_questions, soft_delete_question
+
+from .worker import PeriodicWorker
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mutations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    applied_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_mutations_status ON mutations (status, id);
+"""
+
+
+class MutationFailed(Exception):
+    pass
+
+
+class IdempotencyKeyReused(Exception):
+    """An idempotency key was sent again with a different mutation."""
+
+
+def apply_create(payload, replay=False):
+    results = insert_questions(payload['questions'])
+    return [{'question_id': question_id, 'created': created}
+            for question_id, created in results]
+
+
+def apply_delete(payload, replay=False):
+    if soft_delete_question(payload['question_id']):
+        return {'deleted': payload['question_id']}
+    if replay:
+        # Most likely this mutation deleted it before its outcome was
+        # recorded.
+        return {'deleted': payload['question_id'], 'already_deleted': True}
+    raise MutationFailed('Question not found')
+
+
+OPERATIONS = {
+    'create': apply_create,
+    'delete': apply_delete,
+}
+
+
+def publish_create(changes, payload, result):
+    for item, outcome in zip(payload['questions'], result):
+        if outcome['created']:
+            changes.question_created(outcome['question_id'], item)
+
+
+def publish_delete(changes, payload, result):
+    if not result.get('already_deleted'):
+        changes.question_deleted(payload['question_id'])
+
+
+PUBLISHERS = {
+    'create': publish_create,
+    'delete': publish_delete,
+}
+
+
+class WriteBehindQueue:
+    def __init__(self, path, batch_size=100, interval=1.0, claim_timeout=60,
+                 changes=None):
+        self.path = path
+        self.changes = changes
+        self.batch_size = batch_size
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self._worker = PeriodicWorker(
+            'write-behind', self._drain, interval,
+            error='Write-behind worker error')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        # Full sync: an accepted mutation must survive a crash.
+        connection.execute('PRAGMA synchronous=FULL')
+        return connection
+
+    def enqueue(self, operation, payload, idempotency_key=None):
+        """
+        Append a mutation; returns (mutation, created). A mutation already
+        queued under `idempotency_key` is returned, uncreated, instead of
+        queueing a second one; if it is a different mutation,
+        IdempotencyKeyReused is raised.
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                if idempotency_key:
+                    row = connection.execute(
+                        'SELECT * FROM mutations WHERE idempotency_key = ?',
+                        (idempotency_key,)).fetchone()
+                    if row:
+                        if (row['operation'] != operation
+                                or json.loads(row['payload']) != payload):
+                            raise IdempotencyKeyReused(idempotency_key)
+                        return self._format(row), False
+                cursor = connection.execute(
+                    'INSERT INTO mutations '
+                    '(operation, payload, idempotency_key, created_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (operation, json.dumps(payload), idempotency_key,
+                     time.time()))
+                row = connection.execute(
+                    'SELECT * FROM mutations WHERE id = ?',
+                    (cursor.lastrowid,)).fetchone()
+        finally:
+            connection.close()
+        self._worker.wake()
+        return self._format(row), True
+
+    def get(self, mutation_id):
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT * FROM mutations WHERE id = ?',
+                (mutation_id,)).fetchone()
+        finally:
+            connection.close()
+        return self._format(row) if row else None
+
+    def _format(self, row):
+        return {
+            'id': row['id'],
+            'operation': row['operation'],
+            'status': row['status'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'applied_at': row['applied_at'],
+        }
+
+    def _claim(self):
+        now = time.time()
+        connection = self._connect()
+        try:
+            # If BEGIN itself fails (the file is locked) there is no
+            # transaction to roll back, and its error is the one to raise.
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute(
+                    "SELECT * FROM mutations WHERE status = 'pending' "
+                    "OR (status = 'applying' AND claimed_at < ?) "
+                    "ORDER BY id LIMIT ?",
+                    (now - self.claim_timeout, self.batch_size)).fetchall()
+                connection.executemany(
+                    "UPDATE mutations SET status = 'applying', "
+                    "claimed_at = ? WHERE id = ?",
+                    [(now, row['id']) for row in rows])
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        finally:
+            connection.close()
+        return rows
+
+    def _finish(self, outcomes):
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'UPDATE mutations SET status = ?, result = ?, error = ?, '
+                    'applied_at = ? WHERE id = ?',
+                    [(status, json.dumps(result) if result is not None
+                      else None, error, now, mutation_id)
+                     for mutation_id, status, result, error in outcomes])
+        finally:
+            connection.close()
+
+    def _apply(self, rows):
+        """Apply rows in one transaction; raises if any of them fails."""
+        outcomes = []
+        payloads = []
+        for row in rows:
+            payload = json.loads(row['payload'])
+            # Claimed before: an earlier attempt may have been applied.
+            result = OPERATIONS[row['operation']](
+                payload, replay=row['claimed_at'] is not None)
+            outcomes.append((row['id'], 'applied', result, None))
+            payloads.append((row['operation'], payload, result))
+        db.session.commit()
+        if self.changes is not None:
+            for operation, payload, result in payloads:
+                PUBLISHERS[operation](self.changes, payload, result)
+        return outcomes
+
+    def apply_pending(self):
+        """
+        Apply one batch of queued mutations; must run inside an app context.
+        Returns the number of mutations processed.
+        """
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        try:
+            outcomes = self._apply(rows)
+        except Exception as e:
+            # One bad mutation should not hold back the rest of the batch:
+            # retry them one per transaction to find it.
+            db.session.rollback()
+            logger.warning(f'Write-behind batch failed, retrying singly: {e}')
+            outcomes = []
+            for row in rows:
+                try:
+                    outcomes.extend(self._apply([row]))
+                except Exception as e:
+                    db.session.rollback()
+                    outcomes.append((row['id'], 'failed', None, str(e)))
+        finally:
+            db.session.remove()
+
+        self._finish(outcomes)
+        return len(outcomes)
+
+    def start(self, app):
+        """
+        Start the background worker for `app` unless it is running. It
+        drains the queue straight away, then every `interval` seconds.
+        """
+        self._worker.start(app)
+
+    def _drain(self):
+        while self.apply_pending() == self.batch_size:
+            pass
@@ -1,33 +1,150 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import hashlib
+import heapq
 import json
-from flask_migrate import Migrate
+import uuid
+from datetime import datetime, timedelta
+from operator import itemgetter
+from flask import current_app
+from sqlalchemy import (BigInteger, Column, String, Integer, Text, DateTime,
+                        event, exists, func, inspect, select, text)
+from sqlalchemy.orm import Session, object_session
+from flask_sqlalchemy import SQLAlchemy
 
-from dotenv import load_dotenv
-import os
+db = SQLAlchemy()
 
-load_dotenv()
+_environment_loaded = False
 
-database_name = os.environ.get('DATABASE_NAME', 'trivia')
-database_host = os.environ.get('DATABASE_HOST', 'localhost:5432')
-database_path = f'postgresql://{database_host}/{database_name}'
 
-db = SQLAlchemy()
-migrate = Migrate()
+def load_environment():
+    """
+    Load `.env` into os.environ the first time it is needed rather than at
+    import, so importing the models (or the test suite) stays cheap.
+    """
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
+
+
+def get_database_path():
+    load_environment()
+    database_name = os.environ.get('DATABASE_NAME', 'trivia')
+    database_host = os.environ.get('DATABASE_HOST', 'localhost:5432')
+    return f'postgresql://{database_host}/{database_name}'
+
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. The database URLs
+    in the app's QUESTION_SHARDS config, if any, are added as binds for the
+    question shards; see QuestionShards.
 """
 
 
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    app.config["SQLALCHEMY_DATABASE_URI"] = (
+        database_path or get_database_path())
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    shard_urls = app.config.get('QUESTION_SHARDS') or []
+    if shard_urls:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update((shard_bind_key(shard), url)
+                     for shard, url in enumerate(shard_urls))
+        app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['question_shards'] = QuestionShards(len(shard_urls) or 1)
     db.app = app
     db.init_app(app)
-    migrate.init_app(app, db)
+
+
+"""
+QuestionShards
+
+With QUESTION_SHARDS set to a list of database URLs, questions are spread
+over those databases by category: category `c` lives in shard `c % n`.
+Categories, leaderboards and idempotency keys stay in the main database,
+and each shard keeps a copy of the categories for joins and foreign keys,
+updated by sync_shard_categories whenever a Category change is committed.
+
+Shards number their questions independently, so the API uses global ids,
+local_id * n + shard, from which the shard and local id can be read back.
+Without QUESTION_SHARDS there is one shard, the main database, whose global
+ids are its own ids, so the same code serves both layouts.
+
+Both mappings are arithmetic on n, with no lookup table, so n is fixed for
+the life of the data: with another number of shards, categories map to
+other shards and every global id decodes to another shard and local id.
+Changing QUESTION_SHARDS means copying the questions into a new set of
+shards, as init_question_shards does from the main database, and clients
+holding old ids must drop them.
+"""
+
+
+def shard_bind_key(shard):
+    return f'questions_{shard}'
+
+
+class QuestionShards:
+    def __init__(self, count=1):
+        self.count = count
+
+    def all(self):
+        return range(self.count)
+
+    def for_category(self, category_id):
+        if self.count == 1:
+            return 0
+        return int(category_id) % self.count
+
+    def for_id(self, question_id):
+        return question_id % self.count
+
+    def local_id(self, question_id):
+        return question_id // self.count
+
+    def global_id(self, shard, local_id):
+        return local_id * self.count + shard
+
+    def split_ids(self, question_ids):
+        """Global ids grouped by shard, as {shard: [local ids]}."""
+        local_ids = {}
+        for question_id in question_ids:
+            local_ids.setdefault(self.for_id(question_id), []).append(
+                self.local_id(question_id))
+        return local_ids
+
+    def bind(self, shard):
+        """The shard's engine, or None for the session's own bind."""
+        if self.count == 1:
+            return None
+        return db.get_engine(bind=shard_bind_key(shard))
+
+    def dialect_name(self, shard):
+        bind = self.bind(shard) or db.session.get_bind(Question.__mapper__)
+        return bind.dialect.name
+
+    def execute(self, shard, statement, params=None):
+        """Run `statement` on `shard` in the session's transaction."""
+        return db.session.execute(statement, params, bind=self.bind(shard))
+
+
+def question_shards():
+    """The current app's QuestionShards."""
+    return current_app.extensions.get('question_shards') or QuestionShards()
+
+
+"""
+init_migrate(app)
+    wires Flask-Migrate and its `flask db` commands into the app. Only the
+    CLI needs them, so create_app calls this when run through `flask` and
+    request-serving workers never import alembic.
+"""
+
+
+def init_migrate(app):
+    from flask_migrate import Migrate
+    Migrate(app, db)
 
 
 """
@@ -38,12 +155,29 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Partial indexes: reads only ever look at live rows, and the purge
+        # job only at deleted ones.
+        db.Index('ix_questions_live_category_id', 'category', 'id',
+                 postgresql_where=text('deleted_at IS NULL'),
+                 sqlite_where=text('deleted_at IS NULL')),
+        db.Index('ix_questions_deleted_at', 'deleted_at',
+                 postgresql_where=text('deleted_at IS NOT NULL'),
+                 sqlite_where=text('deleted_at IS NOT NULL')),
+        db.Index('ix_questions_difficulty', 'difficulty'),
+        db.Index('ux_questions_content_hash', 'content_hash', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
     category = Column(Integer, db.ForeignKey('categories.id'), nullable=False)
     difficulty = Column(Integer)
+    # See question_content_hash(); kept up to date by _set_content_hash.
+    content_hash = Column(String(64))
+    # Set by soft_delete_question(); purge_deleted_questions() removes the
+    # row for good later.
+    deleted_at = Column(DateTime)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -62,6 +196,11 @@ class Question(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    @classmethod
+    def live(cls):
+        """Query for the questions that have not been deleted."""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
     def format(self):
         return {
             'id': self.id,
@@ -72,6 +211,519 @@ class Question(db.Model):
         }
 
 
+def question_rows(query, ids=None, category=None, offset=0, limit=None):
+    """
+    Rows of `query` from the shards that can hold them, merged in id order.
+    `query` must select Question.id first and be ordered by it; the ids come
+    back global. `ids` restricts the rows to those global ids and `category`
+    to that category's shard, so only the shards involved are queried.
+
+    `offset` and `limit` apply to the merged rows. With several shards each
+    one returns up to offset + limit rows, so deep pages cost more.
+    """
+    shards = question_shards()
+    if ids is not None:
+        targets = {shard: query.filter(Question.id.in_(local_ids))
+                   for shard, local_ids in shards.split_ids(ids).items()}
+    elif category is not None:
+        targets = {shards.for_category(category): query}
+    else:
+        targets = {shard: query for shard in shards.all()}
+
+    # A single shard can page by itself.
+    pushed = len(targets) == 1
+    results = []
+    for shard, shard_query in targets.items():
+        if pushed:
+            shard_query = shard_query.offset(offset or None).limit(limit)
+        elif limit is not None:
+            shard_query = shard_query.limit(offset + limit)
+        results.append([
+            (shards.global_id(shard, row[0]),) + tuple(row[1:])
+            for row in shards.execute(shard, shard_query.statement)])
+
+    rows = list(heapq.merge(*results, key=itemgetter(0)))
+    if not pushed:
+        rows = rows[offset:None if limit is None else offset + limit]
+    return rows
+
+
+def count_question_rows(query):
+    """Number of rows `query` matches, over every shard."""
+    shards = question_shards()
+    statement = query.order_by(None).with_entities(
+        func.count(Question.id)).statement
+    return sum(shards.execute(shard, statement).scalar()
+               for shard in shards.all())
+
+
+def question_content_hash(question, answer, category):
+    """
+    Identity of a question's content: case-folded, whitespace-collapsed
+    question and answer text plus the category. Two submissions with the
+    same hash are the same question, whatever their difficulty.
+    """
+    def normalize(text):
+        return ' '.join(str(text or '').casefold().split())
+
+    content = '\x1f'.join(
+        [normalize(question), normalize(answer), str(category)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+@event.listens_for(Question, 'before_insert')
+@event.listens_for(Question, 'before_update')
+def _set_content_hash(mapper, connection, target):
+    target.content_hash = question_content_hash(
+        target.question, target.answer, target.category)
+
+
+def insert_questions(rows):
+    """
+    Insert question dicts (question, answer, category, difficulty) with one
+    INSERT, skipping any whose content already exists. Does not commit, so
+    a batch is a single transaction in the caller.
+
+    Returns one (question id, created) pair per row, in order. Rows that
+    repeat earlier rows or existing questions get the existing id and
+    created=False. A row matching a soft-deleted question brings that
+    question back, with the new difficulty, and counts as created. Each row
+    goes to its category's shard, and the ids returned are global.
+    """
+    shards = question_shards()
+    positions = {}
+    for position, row in enumerate(rows):
+        positions.setdefault(
+            shards.for_category(row['category']), []).append(position)
+
+    results = [None] * len(rows)
+    for shard, shard_positions in positions.items():
+        shard_results = _insert_shard_questions(
+            shards, shard, [rows[position] for position in shard_positions])
+        for position, (question_id, created) in zip(
+                shard_positions, shard_results):
+            results[position] = (shards.global_id(shard, question_id), created)
+    return results
+
+
+def _insert_shard_questions(shards, shard, rows):
+    # insert_questions for the rows of one shard, with local ids.
+    table = Question.__table__
+    hashes = [question_content_hash(
+        row['question'], row['answer'], row['category']) for row in rows]
+    new_rows = {}
+    for content_hash, row in zip(hashes, rows):
+        new_rows.setdefault(content_hash, {
+            'question': row['question'],
+            'answer': row['answer'],
+            'category': row['category'],
+            'difficulty': row['difficulty'],
+            'content_hash': content_hash,
+        })
+
+    session = db.session()
+    if shards.dialect_name(shard) == 'postgresql':
+        # Let the unique index arbitrate, so concurrent inserts of the same
+        # question cannot both succeed.
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(list(new_rows.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=['content_hash'],
+            set_={'deleted_at': None,
+                  'difficulty': statement.excluded.difficulty},
+            where=table.c.deleted_at.isnot(None),
+        ).returning(table.c.id, table.c.content_hash)
+        created = {content_hash: question_id for question_id, content_hash
+                   in shards.execute(shard, statement)}
+    else:
+        existing = {content_hash: (question_id, deleted_at)
+                    for question_id, content_hash, deleted_at
+                    in shards.execute(shard, select([
+                        table.c.id, table.c.content_hash,
+                        table.c.deleted_at]).where(
+                            table.c.content_hash.in_(list(new_rows))))}
+        missing = [row for content_hash, row in new_rows.items()
+                   if content_hash not in existing]
+        created = {content_hash: question_id
+                   for content_hash, (question_id, deleted_at)
+                   in existing.items() if deleted_at is not None}
+        for content_hash, question_id in created.items():
+            shards.execute(shard, table.update().where(
+                table.c.id == question_id).values(
+                    deleted_at=None,
+                    difficulty=new_rows[content_hash]['difficulty']))
+        if missing:
+            shards.execute(shard, table.insert(), missing)
+            created.update(
+                (content_hash, question_id)
+                for question_id, content_hash in shards.execute(
+                    shard, select([table.c.id, table.c.content_hash]).where(
+                        table.c.content_hash.in_(
+                            [row['content_hash'] for row in missing]))))
+
+    ids = dict(created)
+    existing_hashes = [content_hash for content_hash in new_rows
+                       if content_hash not in ids]
+    if existing_hashes:
+        ids.update({content_hash: question_id
+                    for question_id, content_hash in shards.execute(
+                        shard,
+                        select([table.c.id, table.c.content_hash]).where(
+                            table.c.content_hash.in_(existing_hashes)))})
+
+    if created:
+        # Core inserts skip the mapper events, so flag the change here.
+        session.info['questions_changed'] = True
+        bump_questions_revision(shard)
+
+    results = []
+    seen = set()
+    for content_hash in hashes:
+        results.append((ids[content_hash],
+                        content_hash in created and content_hash not in seen))
+        seen.add(content_hash)
+    return results
+
+
+def soft_delete_question(question_id):
+    """
+    Mark a question deleted with a single UPDATE on its shard. Does not
+    commit. Returns False when there is no live question with that id.
+    """
+    shards = question_shards()
+    table = Question.__table__
+    deleted = shards.execute(
+        shards.for_id(question_id), table.update().where(
+            table.c.id == shards.local_id(question_id)).where(
+                table.c.deleted_at.is_(None)).values(
+                    deleted_at=datetime.utcnow())).rowcount
+    if deleted:
+        # Core updates skip the mapper events, so flag the change here.
+        db.session().info['questions_changed'] = True
+        bump_questions_revision(shards.for_id(question_id))
+    return bool(deleted)
+
+
+def purge_deleted_questions(older_than=timedelta(0), batch_size=1000):
+    """
+    Permanently delete questions soft-deleted more than `older_than` ago,
+    shard by shard, `batch_size` rows per transaction so each one holds its
+    locks briefly. Returns the number of rows removed.
+    """
+    shards = question_shards()
+    table = Question.__table__
+    cutoff = datetime.utcnow() - older_than
+    purged = 0
+    for shard in shards.all():
+        while True:
+            ids = [question_id for question_id, in shards.execute(
+                shard, select([table.c.id]).where(
+                    table.c.deleted_at < cutoff).limit(batch_size))]
+            if not ids:
+                break
+            shards.execute(shard, table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+            purged += len(ids)
+    return purged
+
+
+"""
+IdempotencyKey
+
+Responses to POST /questions requests sent with an `Idempotency-Key`
+header, stored with the questions they created so a retried request replays
+the original response instead of inserting again. `request_hash` ties a key
+to its request body (see request_content_hash), so a key cannot be reused
+for a different request. Keys expire after IDEMPOTENCY_KEY_TTL seconds and
+are then removed by purge_idempotency_keys.
+"""
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    __table_args__ = (
+        db.Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
+
+    key = Column(String(255), primary_key=True)
+    status_code = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)
+    # NULL for keys stored before request bodies were hashed; those match
+    # any body.
+    request_hash = Column(String(64))
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __init__(self, key, status_code, response, request_hash=None):
+        self.key = key
+        self.status_code = status_code
+        self.response = json.dumps(response)
+        self.request_hash = request_hash
+
+    def matches(self, request_hash):
+        return self.request_hash is None or self.request_hash == request_hash
+
+    def expired(self, ttl):
+        return self.created_at < datetime.utcnow() - timedelta(seconds=ttl)
+
+    def format(self):
+        return json.loads(self.response)
+
+
+def request_content_hash(data):
+    """Hash of a decoded JSON request body, independent of key order."""
+    content = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def purge_idempotency_keys(older_than, batch_size=1000):
+    """
+    Delete idempotency keys created more than `older_than` ago,
+    `batch_size` rows per transaction. Returns the number removed.
+    """
+    table = IdempotencyKey.__table__
+    cutoff = datetime.utcnow() - older_than
+    purged = 0
+    while True:
+        keys = [key for key, in db.session.execute(
+            select([table.c.key]).where(
+                table.c.created_at < cutoff).limit(batch_size))]
+        if not keys:
+            return purged
+        db.session.execute(table.delete().where(table.c.key.in_(keys)))
+        db.session.commit()
+        purged += len(keys)
+
+
+"""
+LeaderboardScore
+
+A player's total score in one category (category_id 0 is the overall
+board). Scores are kept in memory by flaskr.scoring and written here in
+batches by add_leaderboard_scores.
+"""
+
+
+class LeaderboardScore(db.Model):
+    __tablename__ = 'leaderboard_scores'
+
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    player = Column(String(80), primary_key=True)
+    score = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def format(self):
+        return {
+            'category_id': self.category_id,
+            'player': self.player,
+            'score': self.score
+        }
+
+
+def add_leaderboard_scores(increments):
+    """
+    Add {(category_id, player): points} to the stored scores, as
+    increments so that concurrent writers do not overwrite each other. Does
+    not commit.
+    """
+    table = LeaderboardScore.__table__
+    now = datetime.utcnow()
+    rows = [{'category_id': category_id, 'player': player, 'score': points,
+             'updated_at': now}
+            for (category_id, player), points in increments.items()]
+
+    session = db.session()
+    dialect = session.get_bind(LeaderboardScore.__mapper__).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(rows)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['category_id', 'player'],
+            set_={'score': table.c.score + statement.excluded.score,
+                  'updated_at': statement.excluded.updated_at}))
+        return
+
+    missing = []
+    for row in rows:
+        updated = session.execute(table.update().where(
+            (table.c.category_id == row['category_id'])
+            & (table.c.player == row['player'])).values(
+                score=table.c.score + row['score'],
+                updated_at=now))
+        if not updated.rowcount:
+            missing.append(row)
+    if missing:
+        session.execute(table.insert(), missing)
+
+
+"""
+ScoredAnswer
+
+A question a player has already scored. Each (player, question) pair earns
+a point once; add_scored_answers records the pairs with the leaderboard
+increments so a repeated answer, from this process or another, adds
+nothing.
+"""
+
+
+class ScoredAnswer(db.Model):
+    __tablename__ = 'scored_answers'
+
+    player = Column(String(80), primary_key=True)
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+def add_scored_answers(answers):
+    """
+    Record the (player, question_id) pairs in `answers` and return the
+    ones that were not recorded before. Does not commit.
+    """
+    table = ScoredAnswer.__table__
+    now = datetime.utcnow()
+    rows = [{'player': player, 'question_id': question_id, 'created_at': now}
+            for player, question_id in answers]
+    if not rows:
+        return set()
+
+    session = db.session()
+    dialect = session.get_bind(ScoredAnswer.__mapper__).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return {(row.player, row.question_id) for row in session.execute(
+            insert(table).values(rows).on_conflict_do_nothing().returning(
+                table.c.player, table.c.question_id))}
+
+    existing = {(row.player, row.question_id) for row in session.execute(
+        select([table.c.player, table.c.question_id]).where(
+            table.c.player.in_({row['player'] for row in rows})
+            & table.c.question_id.in_({row['question_id'] for row in rows})))}
+    new = [row for row in rows
+           if (row['player'], row['question_id']) not in existing]
+    if new:
+        session.execute(table.insert(), new)
+    return {(row['player'], row['question_id']) for row in new}
+
+
+"""
+Indexes the routes rely on. The composite (category, id) index on live
+rows serves the category filter of get_questions_by_category and play_quiz
+as well as id ordered pages within a category; the trigram index backs the
+ILIKE in search_questions and only exists on PostgreSQL (see the
+2b7c4e9a1f30_add_question_indexes and 8c2f4a6d1e95_add_question_soft_delete
+migrations).
+"""
+
+EXPECTED_INDEXES = {
+    'ix_questions_live_category_id': None,
+    'ix_questions_deleted_at': None,
+    'ix_questions_difficulty': None,
+    'ix_questions_question_trgm': 'postgresql',
+}
+
+
+def missing_indexes(engine):
+    """Return the names of expected indexes not present on `questions`."""
+    present = {index['name']
+               for index in inspect(engine).get_indexes('questions')}
+    return sorted(
+        name for name, dialect in EXPECTED_INDEXES.items()
+        if name not in present
+        and dialect in (None, engine.dialect.name))
+
+
+"""
+questions_version()
+    a counter bumped every time a session that inserted, updated or deleted
+    a Question commits. Caches built from the questions table compare it
+    with the version they were built at to know when they are stale.
+
+on_questions_changed(listener)
+    registers `listener()` to be called after each such commit, for caches
+    that rebuild eagerly instead of on their next read.
+
+questions_revision()
+    the (token, revision) row of QuestionsRevision on every shard. Every
+    write to a questions table bumps its revision in the same transaction,
+    from any process, so unlike questions_version() it also changes for
+    other processes' writes: inserts, edits, deletes and questions brought
+    back by insert_questions. Reading it is one primary key lookup per
+    shard. `token` is random per database, so two databases never share a
+    revision.
+"""
+
+
+class QuestionsRevision(db.Model):
+    __tablename__ = 'questions_revision'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    token = Column(String(32), nullable=False)
+    revision = Column(BigInteger, nullable=False, default=0)
+
+
+@event.listens_for(QuestionsRevision.__table__, 'after_create')
+def _insert_questions_revision(target, connection, **kw):
+    connection.execute(target.insert().values(
+        id=1, token=uuid.uuid4().hex, revision=0))
+
+
+def _bump_questions_revision_statement():
+    table = QuestionsRevision.__table__
+    return table.update().where(table.c.id == 1).values(
+        revision=table.c.revision + 1)
+
+
+def bump_questions_revision(shard=0):
+    """Count a Core write to `shard`'s questions; does not commit."""
+    question_shards().execute(shard, _bump_questions_revision_statement())
+
+
+def questions_revision():
+    shards = question_shards()
+    table = QuestionsRevision.__table__
+    statement = select([table.c.token, table.c.revision]).where(
+        table.c.id == 1)
+    return tuple(tuple(shards.execute(shard, statement).first() or ('', 0))
+                 for shard in shards.all())
+
+
+_questions_version = 0
+_questions_listeners = []
+
+
+def questions_version():
+    return _questions_version
+
+
+def on_questions_changed(listener):
+    _questions_listeners.append(listener)
+
+
+def _mark_questions_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['questions_changed'] = True
+    connection.execute(_bump_questions_revision_statement())
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Question, _event_name, _mark_questions_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_questions_version(session):
+    global _questions_version
+    if session.info.pop('questions_changed', False):
+        _questions_version += 1
+        for listener in _questions_listeners:
+            listener()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_questions_changed(session):
+    session.info.pop('questions_changed', None)
+
+
 """
 Category
 
@@ -83,7 +735,13 @@ class Category(db.Model):
 
     id = Column(Integer, primary_key=True)
     type = Column(String)
-    questions = db.relationship('Question', backref='category_obj', lazy=True)
+    # category_obj raises instead of lazy loading, so formatting a page of
+    # questions can never fall into one SELECT per row; load it with
+    # joinedload(Question.category_obj) or use a category map instead.
+    questions = db.relationship(
+        'Question',
+        backref=db.backref('category_obj', lazy='raise'),
+        lazy=True)
 
     def __init__(self, type):
         self.type = type
@@ -93,3 +751,112 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+def _mark_categories_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['categories_changed'] = True
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event_name, _mark_categories_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _sync_changed_categories(session):
+    # The committed session cannot run SQL; sync_shard_categories uses its
+    # own connections.
+    if session.info.pop('categories_changed', False):
+        sync_shard_categories()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_categories_changed(session):
+    session.info.pop('categories_changed', None)
+
+
+def _sync_categories(connection, categories):
+    # Make a shard's categories table match `categories`, the main
+    # database's rows. Categories its questions still use are kept.
+    table = Category.__table__
+    questions = Question.__table__
+    present = {row['id']: dict(row)
+               for row in connection.execute(select([table]))}
+    missing = [category for category in categories
+               if category['id'] not in present]
+    if missing:
+        connection.execute(table.insert(), missing)
+    for category in categories:
+        if category['id'] in present and present[category['id']] != category:
+            connection.execute(table.update().where(
+                table.c.id == category['id']).values(category))
+    removed = set(present).difference(
+        category['id'] for category in categories)
+    if removed:
+        connection.execute(table.delete().where(
+            table.c.id.in_(removed)).where(~exists().where(
+                questions.c.category == table.c.id)))
+
+
+def sync_shard_categories():
+    """
+    Copy the main database's categories to every shard, outside the
+    session: new ones are added, changed ones updated, and removed ones
+    deleted unless the shard still has questions in them. Shards without
+    tables are skipped; init_question_shards copies the categories there.
+    Runs after each commit that changes a Category; see
+    _sync_changed_categories.
+    """
+    shards = question_shards()
+    if shards.count == 1:
+        return
+    table = Category.__table__
+    with db.get_engine().connect() as connection:
+        categories = [dict(row) for row in connection.execute(
+            select([table]).order_by(table.c.id))]
+    for shard in shards.all():
+        engine = shards.bind(shard)
+        with engine.begin() as connection:
+            if engine.dialect.has_table(connection, table.name):
+                _sync_categories(connection, categories)
+
+
+def init_question_shards():
+    """
+    Create the categories, questions and questions_revision tables on every
+    shard, and bring their categories in line with the main database's
+    (see sync_shard_categories). Live questions of
+    the main database are copied into the shards of their categories, in id
+    order, but only into shards that hold no questions yet, so running it
+    again copies nothing. The copies get new global ids; the main database
+    keeps its rows. Returns (number of shards, number of questions copied).
+    """
+    shards = question_shards()
+    if shards.count == 1:
+        return 0, 0
+    table = Category.__table__
+    questions = Question.__table__
+    categories = [dict(row) for row in db.session.execute(select([table]))]
+    columns = [column for column in questions.c if column.name != 'id']
+    existing = {}
+    for row in db.session.execute(
+            select(columns).where(questions.c.deleted_at.is_(None))
+            .order_by(questions.c.id)):
+        existing.setdefault(shards.for_category(row['category']), []).append(
+            dict(row))
+    copied = 0
+    for shard in shards.all():
+        engine = shards.bind(shard)
+        db.metadata.create_all(
+            engine, tables=[table, questions, QuestionsRevision.__table__])
+        with engine.begin() as connection:
+            _sync_categories(connection, categories)
+            empty = connection.execute(
+                select([func.count()]).select_from(questions)).scalar() == 0
+            rows = existing.get(shard)
+            if empty and rows:
+                connection.execute(questions.insert(), rows)
+                connection.execute(_bump_questions_revision_statement())
+                copied += len(rows)
+    return shards.count, copied
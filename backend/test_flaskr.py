@@ -1,44 +1,214 @@
 import os
-import psycopg2
+import random
+import sqlite3
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
-
-from flaskr import create_app
-from models import setup_db, Question, Category, db
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+
+from flaskr import create_app, formats, get_app
+from flaskr.changes import ChangeFeed
+from flaskr.quiz import AliasTable, QuizSelection, parse_selection
+from flaskr.scoring import answers_match, normalize_answer
+from flaskr.singleflight import SingleFlight
+from flaskr.worker import PeriodicWorker
+from models import (setup_db, missing_indexes, init_question_shards,
+                    soft_delete_question, bump_questions_revision, Question,
+                    Category, IdempotencyKey, LeaderboardScore, ScoredAnswer,
+                    db)
 
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
+SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'trivia.psql')
+
+"""
+Test database
+
+The suite runs against TEST_DATABASE_URL, e.g. `sqlite://` for an in-memory
+SQLite database that needs no server. Without it, it falls back to the
+PostgreSQL database named by TEST_DATABASE_NAME/TEST_DATABASE_HOST.
+
+The schema is created and seeded from trivia.psql once per process in
+setUpModule. Every test then runs inside a transaction on a single
+connection that is rolled back in tearDown, with the app's session working
+in a SAVEPOINT so the routes can commit and roll back freely, so no test
+sees another test's rows and nothing is rebuilt between tests.
+
+Under pytest-xdist (`pytest -n auto test_flaskr.py`) each worker process
+gets its own database: in-memory SQLite databases are per process anyway,
+and PostgreSQL databases get the worker id appended to their name and are
+created on first use.
+"""
+
+
+def get_test_database_url():
+    url = os.environ.get('TEST_DATABASE_URL')
+    if url is None:
+        database_name = os.environ.get('TEST_DATABASE_NAME', 'trivia_test')
+        database_host = os.environ.get('TEST_DATABASE_HOST', 'localhost:5432')
+        url = f'postgresql://{database_host}/{database_name}'
+
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if worker and not url.startswith('sqlite'):
+        url = f'{url}_{worker}'
+        ensure_database(url)
+    return url
+
+
+def ensure_database(url):
+    """Create the PostgreSQL database for `url` if it does not exist."""
+    url = make_url(url)
+    database = url.database
+    url.database = 'postgres'
+    engine = create_engine(url, isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(
+                'SELECT 1 FROM pg_database WHERE datname = %s',
+                (database,)).scalar()
+            if not exists:
+                connection.execute(f'CREATE DATABASE "{database}"')
+    finally:
+        engine.dispose()
+
+
+def read_seed_rows(table):
+    """Rows of `table` from the COPY blocks in trivia.psql."""
+    rows = []
+    with open(SEED_FILE, encoding='utf-8') as seed:
+        copying = False
+        for line in seed:
+            line = line.rstrip('\n')
+            if line.startswith(f'COPY public.{table} '):
+                columns = line[line.index('(') + 1:line.index(')')]
+                columns = [column.strip() for column in columns.split(',')]
+                copying = True
+            elif copying and line == '\\.':
+                break
+            elif copying:
+                rows.append(dict(zip(columns, line.split('\t'))))
+    return rows
+
+
+def seed_database():
+    if Category.query.count() == 0:
+        for row in read_seed_rows('categories'):
+            db.session.add(Category(type=row['type']))
+        db.session.commit()
+    if Question.query.count() == 0:
+        for row in read_seed_rows('questions'):
+            db.session.add(Question(
+                question=row['question'],
+                answer=row['answer'],
+                difficulty=int(row['difficulty']),
+                category=int(row['category'])))
+        db.session.commit()
+
+
+TEST_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': get_test_database_url(),
+    'TESTING': True,
+    'CHECK_INDEXES': False,
+    'RATELIMIT_ENABLED': False,
+    # Rolled back rows never commit, so nothing would tell the quiz pool
+    # they are gone; rebuild it on every draw instead.
+    'QUIZ_POOL_TTL': 0,
+    # Same for page snapshots, which would also be warmed on a background
+    # thread outside the test transaction.
+    'SNAPSHOT_PAGES': 0,
+    'PURGE_INTERVAL': 0,
+    'LEADERBOARD_FLUSH_INTERVAL': 0,
+}
+
+
+def use_sqlite_savepoints(engine):
+    """
+    pysqlite begins transactions on its own and breaks SAVEPOINT; let
+    SQLAlchemy emit BEGIN itself, as recommended in the SQLAlchemy docs.
+    """
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def emit_begin(connection):
+        connection.execute('BEGIN')
+
+
+def parse_events(chunk):
+    """(id, event, data) for each event in a chunk of an SSE stream."""
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode()
+    events = []
+    for message in chunk.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines()
+                      if not line.startswith(':'))
+        if 'event' in fields:
+            events.append(
+                (fields['id'], fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def setUpModule():
+    app = get_app(TEST_CONFIG)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            use_sqlite_savepoints(db.engine)
+        db.create_all()
+        seed_database()
+        db.session.remove()
+
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.database_name = os.environ.get(
-            'TEST_DATABASE_NAME', 'trivia_test')
-        self.database_host = os.environ.get(
-            'TEST_DATABASE_HOST', 'localhost:5432')
-        self.database_path = f'postgresql://{self.database_host}/{self.database_name}'
-
-        self.app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+        self.database_path = TEST_CONFIG['SQLALCHEMY_DATABASE_URI']
+        self.app = get_app(TEST_CONFIG)
         self.client = self.app.test_client
 
         # Push an application context
         self.app_context = self.app.app_context()
         self.app_context.push()
 
-        self.db = SQLAlchemy()
-        self.db.init_app(self.app)
-        self.db.create_all()
+        # Join the app's session to a transaction that tearDown rolls back.
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+        self.session.begin_nested()
+
+        @event.listens_for(self.session(), 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        self.original_session = db.session
+        db.session = self.session
+        self.db = db
 
     def tearDown(self):
         """Executed after each test"""
-        self.db.session.remove()
-        self.db.drop_all()
+        db.session = self.original_session
+        self.session.remove()
+        with warnings.catch_warnings():
+            # SQLAlchemy 1.3 warns when the outer transaction is rolled
+            # back while a restarted SAVEPOINT is still open; the rollback
+            # discards it along with everything else.
+            warnings.filterwarnings('ignore', 'Reset agent is not active')
+            self.transaction.rollback()
+            self.connection.close()
         self.app_context.pop()
 
     # ----------------------------------------------
@@ -55,14 +225,12 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsInstance(data['categories'], dict)
 
     def test_get_categories_failure(self):
-        original_query = Category.query
-        Category.query = None
-
-        res = self.client().get('/categories')
+        # query is a descriptor on db.Model; patch.object removes the
+        # override afterwards instead of pinning a Query to this session.
+        with patch.object(Category, 'query', None):
+            res = self.client().get('/categories')
         data = json.loads(res.data)
 
-        Category.query = original_query
-
         self.assertEqual(res.status_code, 500)
         self.assertFalse(data['success'])
         self.assertEqual(data['error'], 500)
@@ -96,6 +264,103 @@ class TriviaTestCase(unittest.TestCase):
             self.assertIsInstance(question['difficulty'], int)
             self.assertIsInstance(question['category'], int)
 
+    def test_get_questions_snapshot(self):
+        app = create_app(dict(
+            TEST_CONFIG, SNAPSHOT_PAGES=1, SNAPSHOT_WORKER=False))
+        client = app.test_client()
+        snapshots = app.extensions['page_snapshots']
+        live_page = client.get('/questions?page=1').data
+        live_category = client.get('/categories/1/questions').data
+
+        with app.app_context():
+            # Page 1 plus one listing per seeded category
+            self.assertEqual(snapshots.warm(), 1 + Category.query.count())
+
+        # Served without querying the database, byte for byte the same.
+        with patch.object(Question, 'query', None):
+            self.assertEqual(client.get('/questions?page=1').data, live_page)
+            self.assertEqual(client.get('/categories/1/questions').data,
+                             live_category)
+            res = client.get('/questions?page=2')
+            self.assertEqual(res.status_code, 500)
+
+        # A local write makes the snapshots stale until they are rebuilt.
+        with patch('flaskr.snapshots.questions_version', return_value=-1):
+            self.assertIsNone(snapshots.get(('questions', 1)))
+
+    def test_snapshot_warmer_under_cli(self):
+        # CLI commands such as `flask db upgrade` must not start the
+        # warmer; `flask run` starts it with the first request.
+        with patch.dict(os.environ, FLASK_RUN_FROM_CLI='true'), \
+                patch('flaskr.PageSnapshots.start') as start:
+            app = create_app(dict(TEST_CONFIG, SNAPSHOT_PAGES=1))
+            start.assert_not_called()
+            client = app.test_client()
+            client.get('/categories')
+            client.get('/categories')
+            start.assert_called_once_with(app)
+
+    def test_purger_and_leaderboards_under_cli(self):
+        with patch.dict(os.environ, FLASK_RUN_FROM_CLI='true'), \
+                patch('flaskr.DeletedQuestionPurger.start') as purger, \
+                patch('flaskr.Leaderboards.start') as leaderboards:
+            app = create_app(dict(TEST_CONFIG, PURGE_INTERVAL=60,
+                                  LEADERBOARD_FLUSH_INTERVAL=60))
+            purger.assert_not_called()
+            leaderboards.assert_not_called()
+            app.test_client().get('/categories')
+            purger.assert_called_once_with(app)
+            leaderboards.assert_called_once_with(app)
+
+    def test_get_questions_columnar(self):
+        rows = self.client().get('/questions?page=1').get_json()
+        res = self.client().get('/questions?page=1', headers={
+            'Accept': 'application/vnd.trivia.columnar+json'})
+        data = res.get_json()
+
+        self.assertEqual(res.mimetype, 'application/vnd.trivia.columnar+json')
+        self.assertIn('Accept', res.headers['Vary'])
+        self.assertEqual(set(data['questions']),
+                         {'id', 'question', 'answer', 'category',
+                          'difficulty'})
+        self.assertEqual(data['questions']['id'],
+                         [question['id'] for question in rows['questions']])
+        self.assertEqual(data['total_questions'], rows['total_questions'])
+
+        # An empty result keeps its columns, from the requested fields.
+        res = self.client().post(
+            '/questions/search?fields=id,question&embed=category',
+            json={'searchTerm': 'xyzzy'},
+            headers={'Accept': 'application/vnd.trivia.columnar+json'})
+        self.assertEqual(res.get_json()['questions'],
+                         {'id': [], 'question': [], 'category_type': []})
+
+    def test_search_questions_msgpack(self):
+        search_term = {'searchTerm': 'title'}
+        rows = self.client().post(
+            '/questions/search', json=search_term).get_json()
+        res = self.client().post('/questions/search', json=search_term,
+                                 headers={'Accept': 'application/msgpack'})
+
+        self.assertEqual(res.mimetype, 'application/msgpack')
+        self.assertEqual(formats.msgpack.unpackb(res.data), rows)
+
+        res = self.client().get('/categories/1/questions', headers={
+            'Accept': 'application/vnd.trivia.columnar+msgpack'})
+        data = formats.msgpack.unpackb(res.data)
+        self.assertEqual(len(data['questions']['id']),
+                         data['total_questions'])
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export', headers={
+            'Accept': 'application/vnd.trivia.columnar+json'})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], Question.query.count())
+        self.assertEqual(data['questions']['id'],
+                         sorted(data['questions']['id']))
+
     def test_get_questions_failure(self):
         res = self.client().get('/questions?page=1000')
         data = json.loads(res.data)
@@ -136,6 +401,93 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertIn('Not Found', data['message'])
 
+    def test_get_questions_embed_category(self):
+        for i in range(12):
+            db.session.add(Question(
+                question=f'Embed question {i}',
+                answer=f'Embed answer {i}',
+                difficulty=1,
+                category=i % 6 + 1
+            ))
+        db.session.commit()
+
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        self.client().get('/questions?page=1')
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            self.client().get('/questions?page=1')
+            plain_statements = len(statements)
+            del statements[:]
+
+            res = self.client().get('/questions?page=1&embed=category')
+            data = json.loads(res.data)
+            embedded_statements = len(statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(embedded_statements, plain_statements)
+        for question in data['questions']:
+            self.assertEqual(
+                question['category_type'],
+                data['categories'][str(question['category'])])
+
+    def test_search_questions_embed_category(self):
+        res = self.client().post(
+            '/questions/search?embed=category', json={'searchTerm': ''})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        for question in data['questions']:
+            self.assertIsInstance(question['category_type'], str)
+
+    def test_get_questions_fields(self):
+        statements = []
+
+        def record_statement(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine, 'before_cursor_execute', record_statement)
+        try:
+            res = self.client().get(
+                '/questions?page=1&fields=id,question,category')
+            data = json.loads(res.data)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'question', 'category'})
+        selects = [statement for statement in statements
+                   if 'FROM questions' in statement]
+        self.assertTrue(selects)
+        for statement in selects:
+            self.assertNotIn('questions.answer', statement)
+
+    def test_search_questions_fields(self):
+        res = self.client().post(
+            '/questions/search?fields=id,answer&embed=category',
+            json={'searchTerm': ''})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'answer', 'category_type'})
+
+    def test_get_questions_unknown_fields(self):
+        res = self.client().get('/questions?fields=id,secret')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
     # ----------------------------------------------
     # Test POST:/questions
     # ----------------------------------------------
@@ -197,6 +549,383 @@ class TriviaTestCase(unittest.TestCase):
             print(f"Incomplete question response data content: {res.data}")
             self.fail("Failed to decode JSON response for incomplete question")
 
+    def test_create_duplicate_question(self):
+        new_question = {
+            'question': 'Which planet is known as the Red Planet?',
+            'answer': 'Mars',
+            'difficulty': 1,
+            'category': 1
+        }
+        res = self.client().post('/questions', json=new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertFalse(data['duplicate'])
+        question_id = data['question_id']
+
+        # Same content up to case and whitespace
+        res = self.client().post('/questions', json={
+            'question': 'which planet is known as  the red planet?',
+            'answer': 'MARS ',
+            'difficulty': 2,
+            'category': 1
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['duplicate'])
+        self.assertEqual(data['question_id'], question_id)
+        self.assertEqual(Question.query.filter(
+            Question.answer == 'Mars').count(), 1)
+
+    def test_create_questions_batch(self):
+        questions = [{'question': f'Batch question {i}',
+                      'answer': f'Batch answer {i}',
+                      'difficulty': 1,
+                      'category': 2} for i in range(3)]
+        questions.append(dict(questions[0]))
+
+        res = self.client().post('/questions', json=questions)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['total_created'], 3)
+        self.assertEqual(len(data['questions']), 4)
+        self.assertEqual([item['created'] for item in data['questions']],
+                         [True, True, True, False])
+        self.assertEqual(data['questions'][3]['question_id'],
+                         data['questions'][0]['question_id'])
+
+        res = self.client().post('/questions', json={'questions': questions})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_created'], 0)
+
+    def test_create_questions_batch_failure(self):
+        questions = [
+            {'question': 'Complete', 'answer': 'Yes', 'difficulty': 1,
+             'category': 1},
+            {'question': 'Incomplete'}
+        ]
+
+        res = self.client().post('/questions', json=questions)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+        self.assertEqual(Question.query.filter(
+            Question.question == 'Complete').count(), 0)
+
+    def test_create_question_idempotency_key(self):
+        headers = {'Idempotency-Key': 'create-question-1'}
+        new_question = {
+            'question': 'What is the boiling point of water in Celsius?',
+            'answer': '100',
+            'difficulty': 1,
+            'category': 1
+        }
+
+        res = self.client().post(
+            '/questions', json=new_question, headers=headers)
+        first = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().post(
+            '/questions', json=new_question, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(data, first)
+
+        # The key belongs to that body; key order does not matter.
+        res = self.client().post(
+            '/questions', json=dict(reversed(list(new_question.items()))),
+            headers=headers)
+        self.assertEqual(res.status_code, 201)
+        res = self.client().post(
+            '/questions', json=dict(new_question, difficulty=2),
+            headers=headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 422)
+        self.assertIn('Idempotency-Key', data['message'])
+
+    def test_idempotency_key_expiry(self):
+        headers = {'Idempotency-Key': 'create-question-2'}
+        new_question = {
+            'question': 'How many strings does a violin have?',
+            'answer': '4',
+            'difficulty': 1,
+            'category': 1
+        }
+        self.client().post('/questions', json=new_question, headers=headers)
+        stored = IdempotencyKey.query.get('create-question-2')
+        stored.created_at -= timedelta(days=2)
+        db.session.commit()
+
+        # An expired key is free again, even for another body.
+        res = self.client().post(
+            '/questions', json=dict(new_question, answer='Four'),
+            headers=headers)
+        self.assertEqual(res.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', res.headers)
+
+        stored = IdempotencyKey.query.get('create-question-2')
+        stored.created_at -= timedelta(days=2)
+        db.session.commit()
+        purger = self.app.extensions['question_purger']
+        self.assertEqual(purger.expire_idempotency_keys(), 1)
+        self.assertIsNone(IdempotencyKey.query.get('create-question-2'))
+
+    def create_write_behind_app(self, queue_dir):
+        # No worker thread: the test applies the queue itself, on the
+        # session joined to the test transaction.
+        return create_app(dict(
+            TEST_CONFIG,
+            WRITE_BEHIND=True,
+            WRITE_BEHIND_PATH=os.path.join(queue_dir, 'queue.sqlite3'),
+            WRITE_BEHIND_WORKER=False))
+
+    def test_write_behind(self):
+        with tempfile.TemporaryDirectory() as queue_dir:
+            app = self.create_write_behind_app(queue_dir)
+            client = app.test_client()
+            queue = app.extensions['write_behind']
+            changes = app.extensions['question_changes'].stream()
+            next(changes)
+            new_question = {
+                'question': 'Which gas do plants absorb?',
+                'answer': 'Carbon dioxide',
+                'difficulty': 1,
+                'category': 1
+            }
+
+            res = client.post('/questions', json=new_question)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 202)
+            self.assertEqual(data['status'], 'pending')
+            self.assertTrue(
+                res.headers['Location'].endswith(data['status_url']))
+            self.assertEqual(Question.query.filter(
+                Question.answer == 'Carbon dioxide').count(), 0)
+
+            res = client.delete('/questions/99999')
+            self.assertEqual(res.status_code, 202)
+            missing_url = json.loads(res.data)['status_url']
+
+            with app.app_context():
+                self.assertEqual(queue.apply_pending(), 2)
+
+            data = json.loads(client.get(data['status_url']).data)
+            self.assertEqual(data['mutation']['status'], 'applied')
+            question_id = data['mutation']['result'][0]['question_id']
+            self.assertIsNotNone(Question.query.get(question_id))
+            # Published once applied, not when queued.
+            self.assertEqual(
+                [(event, data['id']) for _, event, data
+                 in parse_events(next(changes))],
+                [('created', question_id)])
+
+            # A failing mutation does not hold back the rest of its batch.
+            data = json.loads(client.get(missing_url).data)
+            self.assertEqual(data['mutation']['status'], 'failed')
+            self.assertEqual(data['mutation']['error'], 'Question not found')
+
+            res = client.delete(f'/questions/{question_id}')
+            self.assertEqual(res.status_code, 202)
+            with app.app_context():
+                queue.apply_pending()
+            self.assertIsNone(Question.live().filter(
+                Question.id == question_id).first())
+
+    def test_question_changes(self):
+        res = self.client().get('/questions/changes')
+        stream = iter(res.response)
+        try:
+            self.assertEqual(res.mimetype, 'text/event-stream')
+            self.assertTrue(next(stream).startswith(b'retry:'))
+
+            res_create = self.client().post('/questions', json={
+                'question': 'Which planet is known as the red planet?',
+                'answer': 'Mars',
+                'difficulty': 1,
+                'category': 1
+            })
+            question_id = json.loads(res_create.data)['question_id']
+            [(created_id, event, data)] = parse_events(next(stream))
+            self.assertEqual(event, 'created')
+            self.assertEqual(data['id'], question_id)
+            self.assertEqual(data['answer'], 'Mars')
+
+            self.client().delete(f'/questions/{question_id}')
+            [(_, event, data)] = parse_events(next(stream))
+            self.assertEqual((event, data), ('deleted', {'id': question_id}))
+        finally:
+            res.close()
+
+        # Reconnecting after the created event replays the deletion.
+        res = self.client().get(
+            '/questions/changes', headers={'Last-Event-ID': created_id})
+        stream = iter(res.response)
+        try:
+            next(stream)
+            [(_, event, data)] = parse_events(next(stream))
+            self.assertEqual((event, data), ('deleted', {'id': question_id}))
+        finally:
+            res.close()
+
+    def test_question_changes_reset(self):
+        changes = ChangeFeed(size=2)
+        first_id = changes.question_deleted(1)
+        changes.question_deleted(2)
+
+        stream = changes.stream(first_id)
+        next(stream)
+        self.assertEqual([data for _, _, data in parse_events(next(stream))],
+                         [{'id': 2}])
+
+        # The event after first_id has been evicted, and unknown ids
+        # cannot be resumed from: both get a reset.
+        changes.question_deleted(3)
+        changes.question_deleted(4)
+        for last_event_id in (first_id, 'unknown-1'):
+            stream = changes.stream(last_event_id)
+            next(stream)
+            [(reset_id, event, _)] = parse_events(next(stream))
+            self.assertEqual(event, 'reset')
+
+        # Clients resume from the reset event's id.
+        changes.question_deleted(5)
+        stream = changes.stream(reset_id)
+        next(stream)
+        self.assertEqual([data for _, _, data in parse_events(next(stream))],
+                         [{'id': 5}])
+
+    def test_write_behind_idempotency_key(self):
+        with tempfile.TemporaryDirectory() as queue_dir:
+            client = self.create_write_behind_app(queue_dir).test_client()
+            headers = {'Idempotency-Key': 'queued-question-1'}
+            new_question = {
+                'question': 'How many legs does a spider have?',
+                'answer': '8',
+                'difficulty': 1,
+                'category': 1
+            }
+
+            res = client.post(
+                '/questions', json=new_question, headers=headers)
+            first = json.loads(res.data)
+            res = client.post(
+                '/questions', json=new_question, headers=headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 202)
+            self.assertEqual(res.headers['Idempotent-Replayed'], 'true')
+            self.assertEqual(data['mutation_id'], first['mutation_id'])
+
+            res = client.post('/questions', json=dict(
+                new_question, answer='Eight'), headers=headers)
+            self.assertEqual(res.status_code, 422)
+
+            res = client.get('/mutations/99999')
+            self.assertEqual(res.status_code, 404)
+
+    def test_write_behind_replay(self):
+        with tempfile.TemporaryDirectory() as queue_dir:
+            app = self.create_write_behind_app(queue_dir)
+            client = app.test_client()
+            queue = app.extensions['write_behind']
+            question_id = Question.query.first().id
+
+            res = client.delete(f'/questions/{question_id}')
+            status_url = json.loads(res.data)['status_url']
+            # A worker applied the delete and died before recording it.
+            with app.app_context():
+                [row] = queue._claim()
+                soft_delete_question(question_id)
+            connection = sqlite3.connect(queue.path)
+            with connection:
+                connection.execute('UPDATE mutations SET claimed_at = 0')
+            connection.close()
+
+            with app.app_context():
+                self.assertEqual(queue.apply_pending(), 1)
+            data = json.loads(client.get(status_url).data)['mutation']
+            self.assertEqual(data['status'], 'applied')
+            self.assertEqual(data['result'], {
+                'deleted': question_id, 'already_deleted': True})
+
+    def test_write_behind_claim_locked(self):
+        with tempfile.TemporaryDirectory() as queue_dir:
+            queue = self.create_write_behind_app(
+                queue_dir).extensions['write_behind']
+
+            def connect():
+                connection = sqlite3.connect(queue.path, timeout=0)
+                connection.row_factory = sqlite3.Row
+                return connection
+
+            locker = sqlite3.connect(queue.path, isolation_level=None)
+            locker.execute('BEGIN IMMEDIATE')
+            try:
+                # The busy error is raised, not one from a ROLLBACK with
+                # no transaction open.
+                with patch.object(queue, '_connect', connect), \
+                        self.assertRaisesRegex(sqlite3.OperationalError,
+                                               'locked'):
+                    queue._claim()
+            finally:
+                locker.execute('ROLLBACK')
+                locker.close()
+
+    def test_write_behind_restart(self):
+        with tempfile.TemporaryDirectory() as database_dir:
+            config = dict(
+                TEST_CONFIG,
+                SQLALCHEMY_DATABASE_URI='sqlite:///'
+                + os.path.join(database_dir, 'main.sqlite3'),
+                WRITE_BEHIND=True,
+                WRITE_BEHIND_PATH=os.path.join(database_dir, 'queue.sqlite3'),
+                WRITE_BEHIND_INTERVAL=3600)
+            # The worker thread commits on its own session, outside the
+            # test transaction; use a real database file for it.
+            db.session = self.original_session
+            try:
+                self.check_write_behind_restart(config)
+            finally:
+                db.session = self.session
+
+    def check_write_behind_restart(self, config):
+        # A process that queued a mutation and died before applying it.
+        app = create_app(dict(config, WRITE_BEHIND_WORKER=False))
+        with app.app_context():
+            db.create_all()
+            db.session.add(Category('Science'))
+            db.session.commit()
+        res = app.test_client().post('/questions', json={
+            'question': 'Which planet is closest to the sun?',
+            'answer': 'Mercury',
+            'difficulty': 1,
+            'category': 1
+        })
+        mutation_id = json.loads(res.data)['mutation_id']
+
+        # The next process applies it without waiting for a new write or
+        # for the polling interval.
+        queue = create_app(config).extensions['write_behind']
+        deadline = time.monotonic() + 5
+        while (queue.get(mutation_id)['status'] != 'applied'
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(queue.get(mutation_id)['status'], 'applied')
+        with app.app_context():
+            self.assertEqual(Question.query.filter(
+                Question.answer == 'Mercury').count(), 1)
+
     def test_create_question_failure(self):
         new_question = {
             'question': 'Test question',
@@ -221,16 +950,78 @@ class TriviaTestCase(unittest.TestCase):
             category=1)
         db.session.add(question)
         db.session.commit()
+        question_id = question.id
 
-        res = self.client().delete(f'/questions/{question.id}')
+        res = self.client().delete(f'/questions/{question_id}')
         print(res.get_json())  # Print response to debug
         print(res.data)
         print(res.headers)
         self.assertEqual(res.status_code, 200)
 
-        res = self.client().get(f'/questions/{question.id}')
+        res = self.client().get(f'/questions/{question_id}')
+        self.assertEqual(res.status_code, 404)
+
+    def test_delete_question_soft_delete(self):
+        question = Question(
+            question='Which ocean is the largest?',
+            answer='Pacific',
+            difficulty=1,
+            category=3)
+        db.session.add(question)
+        db.session.commit()
+        question_id = question.id
+
+        res = self.client().delete(f'/questions/{question_id}')
+        self.assertEqual(res.status_code, 200)
+
+        # The row stays until it is purged, but no read path returns it.
+        self.assertIsNotNone(
+            Question.query.get(question_id).deleted_at)
+        data = json.loads(self.client().get(
+            '/categories/3/questions').data)
+        self.assertNotIn(question_id,
+                         [item['id'] for item in data['questions']])
+        data = json.loads(self.client().post(
+            '/questions/search', json={'searchTerm': 'largest ocean'}).data)
+        self.assertEqual(data['total_questions'], 0)
+        data = json.loads(self.client().post('/quizzes', json={
+            'quiz_category': {'id': 3},
+            'previous_questions': [],
+            'num_questions': 50}).data)
+        self.assertNotIn(question_id,
+                         [item['id'] for item in data['questions']])
+        res = self.client().delete(f'/questions/{question_id}')
         self.assertEqual(res.status_code, 404)
 
+        # Posting it again brings the same question back.
+        res = self.client().post('/questions', json={
+            'question': 'Which ocean is the largest?',
+            'answer': 'Pacific',
+            'difficulty': 2,
+            'category': 3})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['question_id'], question_id)
+        self.assertIsNone(Question.query.get(question_id).deleted_at)
+
+    def test_purge_deleted_questions(self):
+        question = Question(
+            question='Which planet has the most moons?',
+            answer='Saturn',
+            difficulty=3,
+            category=1)
+        db.session.add(question)
+        db.session.commit()
+        question_id = question.id
+        self.client().delete(f'/questions/{question_id}')
+
+        purger = self.app.extensions['question_purger']
+        with patch.object(purger, 'retention', 3600):
+            self.assertEqual(purger.purge(), 0)
+        with patch.object(purger, 'retention', 0):
+            self.assertEqual(purger.purge(), 1)
+        self.assertIsNone(Question.query.get(question_id))
+
     def test_delete_question_failure(self):
         res = self.client().delete('/questions/99999')
         data = json.loads(res.data)
@@ -388,7 +1179,7 @@ class TriviaTestCase(unittest.TestCase):
             question = data['question']
             self.assertIsInstance(question, dict)
             self.assertIn('question', question)
-            self.assertIn('answer', question)
+            self.assertNotIn('answer', question)
             self.assertIn('category', question)
             self.assertIn('id', question)
 
@@ -406,6 +1197,149 @@ class TriviaTestCase(unittest.TestCase):
             1,
             "Questions were not from multiple categories")
 
+    def test_play_quiz_batch(self):
+        for i in range(6):
+            self.client().post('/questions', json={
+                'question': f'Batch quiz question {i}',
+                'answer': f'Answer {i}',
+                'difficulty': 2,
+                'category': 2
+            })
+
+        quiz_data = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0},
+            'num_questions': 5
+        }
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIsInstance(data['questions'], list)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertEqual(data['total_questions'], 5)
+        question_ids = [question['id'] for question in data['questions']]
+        self.assertEqual(len(set(question_ids)), 5)
+
+        quiz_data['previous_questions'] = question_ids
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        for question in data['questions']:
+            self.assertNotIn(question['id'], question_ids)
+
+    def test_play_quiz_batch_failure(self):
+        quiz_data = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0},
+            'num_questions': 0
+        }
+
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'], 422)
+
+    def test_play_quiz_by_difficulty(self):
+        # Every difficulty from 1 to 5 has questions in category 1, so each
+        # selection below has something to draw.
+        for i, difficulty in enumerate([1, 5, 1, 5, 2, 3, 4]):
+            res = self.client().post('/questions', json={
+                'question': f'Difficulty test question {i}',
+                'answer': f'Answer {i}',
+                'difficulty': difficulty,
+                'category': 1
+            })
+            self.assertEqual(res.status_code, 201)
+
+        quiz_data = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'Science', 'id': 1},
+            'difficulty': 5
+        }
+        for _ in range(5):
+            res = self.client().post('/quizzes', json=quiz_data)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(data['success'])
+            self.assertEqual(data['question']['difficulty'], 5)
+            self.assertEqual(data['question']['category'], 1)
+
+        quiz_data = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'Science', 'id': 1},
+            'min_difficulty': 2,
+            'max_difficulty': 4,
+            'target_difficulty': 3
+        }
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(data['question'])
+        self.assertIn(data['question']['difficulty'], [2, 3, 4])
+        self.assertEqual(data['question']['category'], 1)
+
+    def test_target_difficulty_is_bounded(self):
+        # Targets key the alias table cache, so near-identical and out of
+        # range targets share one entry.
+        keys = {parse_selection({'target_difficulty': target}).key
+                for target in (2.6, 3, 3.4999)}
+        self.assertEqual(keys, {(None, None, None, 3)})
+        self.assertEqual(
+            parse_selection({'target_difficulty': 1e9}).target_difficulty, 5)
+        self.assertEqual(
+            parse_selection({'target_difficulty': -7}).target_difficulty, 1)
+
+    def test_target_difficulty_weighting(self):
+        # Equal buckets at difficulties 1 to 5: draws should follow the
+        # target weights, so 3 comes up most and 1 and 5 least.
+        selection = QuizSelection(target_difficulty=3)
+        difficulties = [1, 2, 3, 4, 5]
+        weights = [10 * selection.weight(d) for d in difficulties]
+        table = AliasTable(difficulties, weights)
+        rng = random.Random(1234)
+        draws = 20000
+        counts = {d: 0 for d in difficulties}
+        for _ in range(draws):
+            counts[table.sample(rng)] += 1
+
+        total = sum(weights)
+        for difficulty, weight in zip(difficulties, weights):
+            self.assertAlmostEqual(
+                counts[difficulty] / draws, weight / total, delta=0.01)
+        # Weights 1/9, 1/4, 1, 1/4, 1/9 of the target's.
+        self.assertGreater(counts[3], 3 * max(counts[2], counts[4]))
+        self.assertGreater(min(counts[2], counts[4]),
+                           2 * max(counts[1], counts[5]))
+
+    def test_play_quiz_non_integer_difficulty(self):
+        for name in ('difficulty', 'min_difficulty', 'max_difficulty'):
+            res = self.client().post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'type': 'click', 'id': 0},
+                name: 2.5})
+            self.assertEqual(res.status_code, 422, name)
+
+    def test_play_quiz_by_difficulty_failure(self):
+        quiz_data = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'click', 'id': 0},
+            'difficulty': 'hard'
+        }
+
+        res = self.client().post('/quizzes', json=quiz_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'], 422)
+
     def test_get_quiz_failure(self):
         quiz_data = {
             'previous_questions': 'invalid',
@@ -420,6 +1354,542 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 422)
         self.assertIn('Unprocessable Entity', data['message'])
 
+    def test_precomputed_tables(self):
+        app = create_app(dict(
+            TEST_CONFIG, PRECOMPUTE_WORKERS=2, PRECOMPUTE_WORKER=False))
+        client = app.test_client()
+        precomputer = app.extensions['precomputer']
+        with app.app_context():
+            self.assertEqual(precomputer.rebuild(), Question.query.count())
+
+        # The published buckets hold every question of a category.
+        data = json.loads(client.post('/quizzes', json={
+            'quiz_category': {'id': 4},
+            'previous_questions': [],
+            'num_questions': 50}).data)
+        self.assertEqual(
+            sorted(question['id'] for question in data['questions']),
+            sorted(question.id for question in Question.query.filter(
+                Question.category == 4)))
+
+        # Searches narrowed by the trigram index find what a scan finds.
+        published = precomputer.current()
+        for term in ['title', 'TITLE', 'the', 'xyzzy', 'ca', '%']:
+            expected = self.client().post(
+                '/questions/search', json={'searchTerm': term}).get_json()
+            data = client.post(
+                '/questions/search', json={'searchTerm': term}).get_json()
+            self.assertEqual(
+                sorted(question['id'] for question in data['questions']),
+                sorted(question['id'] for question in expected['questions']),
+                term)
+        self.assertEqual(published.candidates('xyzzy'), [])
+        self.assertIsNone(published.candidates('ca'))
+        self.assertIsNone(published.candidates('100%'))
+
+        # Another app process reading the same revision attaches to the
+        # published segment instead of building.
+        other = create_app(dict(
+            TEST_CONFIG, PRECOMPUTE_WORKERS=2, PRECOMPUTE_WORKER=False))
+        attached = other.extensions['precomputer']
+        with other.app_context():
+            self.assertEqual(attached.rebuild(), Question.query.count())
+        self.assertIsNone(attached._executor)
+        self.assertEqual(attached.current().candidates('title'),
+                         published.candidates('title'))
+
+        # A question added by another process does not move
+        # questions_version, but the stale index is not used for it.
+        question_id = db.session.execute(Question.__table__.insert().values(
+            question='What is a xyzzy?', answer='A magic word',
+            category=1, difficulty=1)).inserted_primary_key[0]
+        bump_questions_revision()
+        data = client.post(
+            '/questions/search', json={'searchTerm': 'xyzzy'}).get_json()
+        self.assertEqual([question['id'] for question in data['questions']],
+                         [question_id])
+
+        # Nor is it for another process's edit, once rebuilt.
+        with app.app_context():
+            precomputer.rebuild()
+        question = Question.query.get(question_id)
+        question.question = 'What is a plugh?'
+        db.session.flush()
+        data = client.post(
+            '/questions/search', json={'searchTerm': 'plugh'}).get_json()
+        self.assertEqual([question['id'] for question in data['questions']],
+                         [question_id])
+
+    def test_precomputed_revision_ttl(self):
+        app = create_app(dict(
+            TEST_CONFIG, QUIZ_POOL_TTL=60, PRECOMPUTE_WORKERS=1,
+            PRECOMPUTE_WORKER=False))
+        precomputer = app.extensions['precomputer']
+        with app.app_context():
+            precomputer.rebuild()
+            # The revision is read at most once per ttl, not per search.
+            with patch('flaskr.precompute.questions_revision') as revision:
+                self.assertEqual(precomputer.search_candidates('xyzzy'), [])
+                revision.assert_not_called()
+                later = time.monotonic() + 61
+                with patch('flaskr.precompute.time.monotonic',
+                           return_value=later):
+                    self.assertIsNone(precomputer.search_candidates('xyzzy'))
+                    self.assertIsNone(precomputer.search_candidates('xyzzy'))
+                revision.assert_called_once_with()
+
+    # ----------------------------------------------
+    # Test POST:/quizzes/answers
+    # ----------------------------------------------
+    def test_check_answer(self):
+        question = Question.query.filter(
+            Question.answer == 'Maya Angelou').first()
+
+        for guess, correct in [('maya angelou', True),
+                               ('  Maya   Angelou! ', True),
+                               ('Dr. Maya Angelou', True),
+                               ('Maya Angelu', True),
+                               ('Toni Morrison', False),
+                               ('Toni Morrison or Maya Angelou', False),
+                               ('', False)]:
+            res = self.client().post('/quizzes/answers', json={
+                'question_id': question.id, 'answer': guess})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['correct'], correct, guess)
+            self.assertEqual(data['answer'], 'Maya Angelou')
+            self.assertNotIn('score', data)
+
+    def test_answers_match(self):
+        # Extra words that could be answers themselves are refused, and
+        # numbers and short answers never get the containment check.
+        for guess, answer, correct in [
+                ('the Beatles', 'Beatles', True),
+                ('Dr. Maya Angelou', 'Maya Angelou', True),
+                ('poet Maya Angelou', 'Maya Angelou', True),
+                ('3 4', '4', False),
+                ('1990 1991', '1990', False),
+                ('Uruguay Brazil', 'Uruguay', False),
+                ('Ra Re', 'Ra', False),
+                ('Maya Angelou 1928', 'Maya Angelou', False)]:
+            self.assertEqual(
+                answers_match(guess, normalize_answer(answer)), correct,
+                (guess, answer))
+
+    def test_check_answer_written_elsewhere(self):
+        client = create_app(dict(TEST_CONFIG, QUIZ_POOL_TTL=60)).test_client()
+        client.post('/quizzes/answers', json={
+            'question_id': 1, 'answer': 'Paris'})
+        # Another process's insert does not move questions_version.
+        question_id = db.session.execute(Question.__table__.insert().values(
+            question='Which river flows through Cairo?', answer='Nile',
+            category=3, difficulty=1)).inserted_primary_key[0]
+
+        def answer():
+            return client.post('/quizzes/answers', json={
+                'question_id': question_id, 'answer': 'the Nile'})
+
+        self.assertEqual(answer().status_code, 404)
+        later = time.monotonic() + 61
+        with patch('flaskr.scoring.time.monotonic', return_value=later):
+            res = answer()
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(json.loads(res.data)['correct'])
+
+    def test_check_answer_failure(self):
+        res = self.client().post('/quizzes/answers', json={
+            'question_id': 99999, 'answer': 'Paris'})
+        self.assertEqual(res.status_code, 404)
+
+        res = self.client().post('/quizzes/answers', json={
+            'question_id': '1', 'answer': 'Paris'})
+        self.assertEqual(res.status_code, 422)
+
+    def test_leaderboards(self):
+        app = create_app(TEST_CONFIG)
+        client = app.test_client()
+        question = Question.query.filter(
+            Question.answer == 'Maya Angelou').first()
+        other = Question(question='Who wrote Beloved?',
+                         answer='Toni Morrison',
+                         category=question.category, difficulty=2)
+        other.insert()
+        category_id, ids = question.category, (question.id, other.id)
+
+        def answer(player, guess, question_id=ids[0]):
+            return json.loads(client.post('/quizzes/answers', json={
+                'question_id': question_id, 'answer': guess,
+                'player': player}).data)
+
+        answer('ada', 'Maya Angelou')
+        answer('grace', 'Maya Angelou')
+        data = answer('grace', 'Toni Morrison', ids[1])
+        self.assertEqual((data['score'], data['rank']), (2, 1))
+        # A question scores once per player.
+        data = answer('grace', 'Maya Angelou')
+        self.assertTrue(data['correct'])
+        self.assertEqual((data['score'], data['rank']), (2, 1))
+        data = answer('ada', 'wrong', ids[1])
+        self.assertFalse(data['correct'])
+        self.assertEqual((data['score'], data['rank']), (1, 2))
+
+        for board_id in (category_id, 0):
+            data = json.loads(client.get(
+                f'/leaderboards/{board_id}?player=ada').data)
+            self.assertEqual(
+                [(leader['player'], leader['score'])
+                 for leader in data['leaders']],
+                [('grace', 2), ('ada', 1)])
+            self.assertEqual(data['player']['rank'], 2)
+
+        # Scores reach the database only when flushed, as increments.
+        leaderboards = app.extensions['leaderboards']
+        with app.app_context():
+            self.assertEqual(leaderboards.flush(), 4)
+            answer('ada', 'Toni Morrison', ids[1])
+            self.assertEqual(leaderboards.flush(), 2)
+        stored = LeaderboardScore.query.filter(
+            LeaderboardScore.category_id == category_id).all()
+        self.assertEqual({row.player: row.score for row in stored},
+                         {'ada': 2, 'grace': 2})
+
+        # Another process scoring the same answer first: the flush skips
+        # it. Scores written by other processes show up after a refresh,
+        # under the increments this one has not written yet.
+        third = Question(question='Who wrote Invisible Man?',
+                         answer='Ralph Ellison',
+                         category=category_id, difficulty=2)
+        third.insert()
+        third_id = third.id
+        db.session.add_all([
+            LeaderboardScore(category_id=category_id, player='linus',
+                             score=5),
+            ScoredAnswer(player='grace', question_id=third_id)])
+        db.session.commit()
+        answer('ada', 'Ralph Ellison', third_id)
+        answer('grace', 'Ralph Ellison', third_id)
+        with app.app_context():
+            self.assertEqual(leaderboards.flush(), 2)
+            leaderboards.refresh()
+        self.assertEqual(leaderboards.top(category_id),
+                         [{'rank': 1, 'player': 'linus', 'score': 5},
+                          {'rank': 2, 'player': 'ada', 'score': 3},
+                          {'rank': 3, 'player': 'grace', 'score': 2}])
+        # The refresh loaded the stored answers, so they do not score.
+        data = answer('grace', 'Ralph Ellison', third_id)
+        self.assertEqual(data['score'], 2)
+
+        res = client.get('/leaderboards/1000')
+        self.assertEqual(res.status_code, 404)
+
+    # ----------------------------------------------
+    # Test question shards
+    # ----------------------------------------------
+    def test_question_shards(self):
+        with tempfile.TemporaryDirectory() as database_dir:
+            main_url, *shard_urls = [
+                f'sqlite:///{os.path.join(database_dir, name)}.sqlite3'
+                for name in ('main', 'shard0', 'shard1')]
+            # These commits are real, so the quiz pool can be cached.
+            app = create_app(dict(
+                TEST_CONFIG, SQLALCHEMY_DATABASE_URI=main_url,
+                QUESTION_SHARDS=shard_urls, QUIZ_POOL_TTL=60))
+            # The shards are separate databases, outside the test
+            # transaction; use the app's own session for them.
+            db.session = self.original_session
+            try:
+                self.check_question_shards(app)
+            finally:
+                db.session = self.session
+
+    def test_init_question_shards_copies_questions(self):
+        with tempfile.TemporaryDirectory() as database_dir:
+            main_url, *shard_urls = [
+                f'sqlite:///{os.path.join(database_dir, name)}.sqlite3'
+                for name in ('main', 'shard0', 'shard1')]
+            db.session = self.original_session
+            try:
+                self.check_init_question_shards(main_url, shard_urls)
+            finally:
+                db.session = self.session
+
+    def check_init_question_shards(self, main_url, shard_urls):
+        # Questions written before QUESTION_SHARDS was set.
+        app = create_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI=main_url))
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(
+                Category(type) for type in ('Science', 'Art', 'Geography'))
+            db.session.add_all(
+                Question(f'Old question {i}', f'Old answer {i}', i % 3 + 1, 1)
+                for i in range(4))
+            db.session.commit()
+            soft_delete_question(4)
+            db.session.commit()
+
+        app = create_app(dict(
+            TEST_CONFIG, SQLALCHEMY_DATABASE_URI=main_url,
+            QUESTION_SHARDS=shard_urls, SLOW_QUERY_LOG=True,
+            SLOW_QUERY_THRESHOLD_MS=0))
+        with app.app_context():
+            self.assertEqual(init_question_shards(), (2, 3))
+            self.assertEqual(init_question_shards(), (2, 0))
+
+        client = app.test_client()
+        data = client.get('/questions').get_json()
+        self.assertEqual(data['total_questions'], 3)
+        self.assertEqual(
+            sorted(question['question'] for question in data['questions']),
+            ['Old question 0', 'Old question 1', 'Old question 2'])
+        # Each shard was read, and its queries were timed too.
+        self.assertEqual({question['id'] % 2
+                          for question in data['questions']}, {0, 1})
+        slow_queries = client.get('/debug/slow-queries').get_json()
+        self.assertTrue(any(
+            query['route'] == '/questions'
+            and 'FROM questions' in query['statement']
+            for query in slow_queries['queries']))
+
+    def check_question_shards(self, app):
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(
+                Category(type) for type in ('Science', 'Art', 'Geography'))
+            db.session.commit()
+            self.assertEqual(init_question_shards(), (2, 0))
+            shard_engines = [db.get_engine(bind=f'questions_{shard}')
+                             for shard in range(2)]
+
+            # Categories written later reach every shard on commit.
+            db.session.add(Category('History'))
+            Category.query.get(3).type = 'Geo'
+            db.session.commit()
+            for engine in shard_engines:
+                self.assertEqual(
+                    list(engine.execute(
+                        'SELECT id, type FROM categories ORDER BY id')),
+                    [(1, 'Science'), (2, 'Art'), (3, 'Geo'), (4, 'History')])
+            db.session.delete(Category.query.get(4))
+            db.session.commit()
+            for engine in shard_engines:
+                self.assertEqual(engine.execute(
+                    'SELECT count(*) FROM categories').scalar(), 3)
+
+        res = client.post('/questions', json=[{
+            'question': f'Sharded question {i}',
+            'answer': f'Sharded answer {i}',
+            'difficulty': 1,
+            'category': i % 3 + 1
+        } for i in range(12)])
+        self.assertEqual(res.status_code, 201)
+        question_ids = [item['question_id']
+                        for item in json.loads(res.data)['questions']]
+        self.assertEqual(len(set(question_ids)), 12)
+        # Category c lives in shard c % 2, and ids carry their shard.
+        for i, question_id in enumerate(question_ids):
+            self.assertEqual(question_id % 2, (i % 3 + 1) % 2)
+        for shard, engine in enumerate(shard_engines):
+            categories = {category for category, in engine.execute(
+                'SELECT category FROM questions')}
+            self.assertEqual(categories, {category for category in (1, 2, 3)
+                                          if category % 2 == shard})
+
+        # Listings merge the shards in id order.
+        listed = []
+        for page in (1, 2):
+            data = json.loads(client.get(f'/questions?page={page}').data)
+            self.assertEqual(data['total_questions'], 12)
+            listed += [question['id'] for question in data['questions']]
+        self.assertEqual(listed, sorted(question_ids))
+        data = json.loads(client.post(
+            '/questions/search', json={'searchTerm': 'sharded'}).data)
+        self.assertEqual([question['id'] for question in data['questions']],
+                         sorted(question_ids))
+
+        # "All" quizzes draw from every shard.
+        data = json.loads(client.post('/quizzes', json={
+            'quiz_category': {'id': 0},
+            'previous_questions': [],
+            'num_questions': 12}).data)
+        self.assertEqual(sorted(question['id']
+                                for question in data['questions']),
+                         sorted(question_ids))
+
+        # Category listings and quizzes only query the category's shard.
+        statements = []
+
+        def record_statement(*args):
+            statements.append(args[2])
+
+        event.listen(shard_engines[1], 'before_cursor_execute',
+                     record_statement)
+        try:
+            data = json.loads(client.get('/categories/2/questions').data)
+            self.assertEqual(data['total_questions'], 4)
+            self.assertEqual(data['current_category'], 'Art')
+            data = json.loads(client.post('/quizzes', json={
+                'quiz_category': {'id': 2},
+                'previous_questions': [],
+                'num_questions': 4}).data)
+            self.assertEqual({question['category']
+                              for question in data['questions']}, {2})
+            self.assertEqual(
+                {question['id'] for question in data['questions']},
+                set(question_ids[1::3]))
+        finally:
+            event.remove(shard_engines[1], 'before_cursor_execute',
+                         record_statement)
+        self.assertEqual(statements, [])
+
+        data = json.loads(client.post('/quizzes/answers', json={
+            'question_id': question_ids[0],
+            'answer': 'Sharded answer 0'}).data)
+        self.assertTrue(data['correct'])
+
+        res = client.delete(f'/questions/{question_ids[0]}')
+        self.assertEqual(res.status_code, 200)
+        res = client.delete(f'/questions/{question_ids[0]}')
+        self.assertEqual(res.status_code, 404)
+        data = json.loads(client.get('/questions?page=2').data)
+        self.assertEqual(data['total_questions'], 11)
+        self.assertEqual(len(data['questions']), 1)
+
+    # ----------------------------------------------
+    # Test indexes
+    # ----------------------------------------------
+    def test_missing_indexes(self):
+        # create_all builds every index the models declare; only the
+        # PostgreSQL trigram index comes from a migration alone.
+        declared = {index.name for index in Question.__table__.indexes}
+        missing = missing_indexes(db.engine)
+        if db.engine.dialect.name == 'sqlite':
+            self.assertEqual(missing, [])
+        else:
+            self.assertFalse(declared.intersection(missing))
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(
+            engine, tables=[Category.__table__, Question.__table__])
+        self.assertEqual(missing_indexes(engine), [])
+        engine.execute('DROP INDEX ix_questions_difficulty')
+        self.assertEqual(missing_indexes(engine), ['ix_questions_difficulty'])
+
+    # ----------------------------------------------
+    # Test GET:/debug/slow-queries
+    # ----------------------------------------------
+    def test_slow_queries(self):
+        # This app has its own engine, so it must not use the session that
+        # is joined to the test transaction.
+        db.session = self.original_session
+        try:
+            app = create_app(dict(
+                TEST_CONFIG, SLOW_QUERY_LOG=True, SLOW_QUERY_THRESHOLD_MS=0))
+            with app.app_context():
+                db.create_all()
+            client = app.test_client()
+            client.get('/categories')
+
+            res = client.get('/debug/slow-queries')
+            data = json.loads(res.data)
+        finally:
+            db.session = self.session
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertGreater(len(data['queries']), 0)
+        # Newest first: the categories query, after create_all's DDL.
+        query = data['queries'][0]
+        self.assertEqual(query['route'], '/categories')
+        self.assertEqual(query['endpoint'], 'get_categories')
+        self.assertIn('categories', query['statement'])
+
+    def test_slow_queries_disabled(self):
+        res = self.client().get('/debug/slow-queries')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    # ----------------------------------------------
+    # Test rate limiting
+    # ----------------------------------------------
+    def test_rate_limit(self):
+        app = create_app(dict(
+            TEST_CONFIG,
+            RATELIMIT_ENABLED=True,
+            RATELIMIT_RULES={'search_questions': '2/minute'},
+            RATELIMIT_KEY_RULES={'partner': {'search_questions': '5/minute'}}
+        ))
+        client = app.test_client()
+        search_term = {'searchTerm': 'title'}
+
+        for _ in range(2):
+            res = client.post('/questions/search', json=search_term)
+            self.assertEqual(res.status_code, 200)
+
+        res = client.post('/questions/search', json=search_term)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'], 429)
+        self.assertGreaterEqual(int(res.headers['Retry-After']), 1)
+
+        # Keys with their own quota get their own bucket; unknown keys
+        # share the caller's IP bucket.
+        res = client.post('/questions/search', json=search_term,
+                          headers={'X-API-Key': 'partner'})
+        self.assertEqual(res.status_code, 200)
+        res = client.post('/questions/search', json=search_term,
+                          headers={'X-API-Key': 'unknown'})
+        self.assertEqual(res.status_code, 429)
+
+        # Endpoints without a rule are not limited.
+        res = client.get('/categories')
+        self.assertEqual(res.status_code, 200)
+
+    def test_rate_limit_rules_from_environment(self):
+        with patch.dict(os.environ, RATELIMIT_RULES='{"play_quiz": "5/hour"}',
+                        RATELIMIT_KEY_RULES='{"partner": {}}'):
+            app = create_app(dict(TEST_CONFIG, RATELIMIT_ENABLED=True))
+        self.assertEqual(app.config['RATELIMIT_RULES'],
+                         {'play_quiz': '5/hour'})
+        self.assertEqual(app.config['RATELIMIT_KEY_RULES'], {'partner': {}})
+
+        for name, value, message in [
+                ('RATELIMIT_RULES', '{"play_quiz": ', 'not valid JSON'),
+                ('RATELIMIT_RULES', '{"play_quiz": "five/hour"}',
+                 "'five/hour'"),
+                ('RATELIMIT_RULES', '["5/hour"]', 'map endpoints'),
+                ('RATELIMIT_KEY_RULES', '{"partner": "5/hour"}',
+                 'map endpoints')]:
+            with patch.dict(os.environ, {name: value}), \
+                    self.assertRaisesRegex(ValueError, message):
+                create_app(dict(TEST_CONFIG, RATELIMIT_ENABLED=True))
+
+    def test_rate_limit_behind_proxy(self):
+        app = create_app(dict(
+            TEST_CONFIG,
+            RATELIMIT_ENABLED=True,
+            RATELIMIT_RULES={'search_questions': '1/minute'},
+            TRUSTED_PROXIES=1
+        ))
+        client = app.test_client()
+        search_term = {'searchTerm': 'title'}
+
+        # Every request comes from the proxy's address; the clients behind
+        # it still get a bucket each.
+        for client_address in ('203.0.113.7', '203.0.113.8'):
+            res = client.post(
+                '/questions/search', json=search_term,
+                headers={'X-Forwarded-For': client_address})
+            self.assertEqual(res.status_code, 200)
+        res = client.post('/questions/search', json=search_term,
+                          headers={'X-Forwarded-For': '203.0.113.7'})
+        self.assertEqual(res.status_code, 429)
+
     def test_404_error(self):
         # Test case 1: Request a non-existent resource
         res = self.client().get('/non-existent-resource')
@@ -452,5 +1922,105 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'Request data is incomplete')
 
 
+class SingleFlightTestCase(unittest.TestCase):
+    """Request coalescing, without a database"""
+
+    def test_concurrent_calls_share_one_result(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return {'page': 1}
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    single_flight.do(('questions', 1), load)))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'page': 1}] * 5)
+
+        # Nothing is cached once the call has finished.
+        single_flight.do(('questions', 1), load)
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_are_shared(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            release.wait(5)
+            raise ValueError('database is down')
+
+        errors = []
+
+        def call():
+            try:
+                single_flight.do(('categories',), fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        # One failed call, and every waiting caller got its error.
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(error is errors[0] for error in errors))
+
+        # The error is not remembered either.
+        self.assertEqual(single_flight.do(('categories',), lambda: 1), 1)
+
+
+class PeriodicWorkerTestCase(unittest.TestCase):
+    """The shared background loop, without a database"""
+
+    def test_wake_and_errors(self):
+        app = create_app(TEST_CONFIG)
+        calls = []
+        called = threading.Event()
+
+        def task():
+            calls.append(1)
+            called.set()
+            if len(calls) == 1:
+                raise ValueError('database is down')
+
+        worker = PeriodicWorker('test-worker', task, interval=3600,
+                                error='Test task failed')
+        with self.assertLogs('flaskr.worker', 'WARNING') as logs:
+            self.assertTrue(worker.start(app))
+            self.assertTrue(called.wait(5))
+            called.clear()
+            self.assertFalse(worker.start(app))
+
+            # A failed run does not stop the loop; waking runs it again
+            # without waiting for the interval.
+            worker.wake()
+            self.assertTrue(called.wait(5))
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(logs.output, [
+            'WARNING:flaskr.worker:Test task failed: database is down'])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -13,11 +13,88 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      // "list", "category" or "search": which request filled the page.
+      view: "list",
     };
+    // Ids of the deleted questions already taken off the count.
+    this.removed = new Set();
   }
 
   componentDidMount() {
     this.getQuestions();
+    this.watchChanges();
+  }
+
+  componentWillUnmount() {
+    if (this.changes) {
+      this.changes.close();
+    }
+  }
+
+  // Applies created and deleted questions from the server's change feed to
+  // the page shown, instead of fetching the page again. Only events that
+  // belong to the view shown change it: a category view only takes
+  // questions of its category, and search results are not re-run.
+  watchChanges() {
+    if (!window.EventSource) {
+      return;
+    }
+    this.changes = new EventSource("/questions/changes");
+    this.changes.addEventListener("created", (event) => {
+      const question = JSON.parse(event.data);
+      // A deleted question posted again comes back with its old id.
+      this.removed.delete(question.id);
+      this.setState((state) => {
+        if (state.view === "list") {
+          const onLastPage =
+            state.page === Math.max(Math.ceil(state.totalQuestions / 10), 1);
+          return {
+            questions:
+              onLastPage && state.questions.length < 10
+                ? [...state.questions, question]
+                : state.questions,
+            totalQuestions: state.totalQuestions + 1,
+          };
+        }
+        if (
+          state.view === "category" &&
+          state.categories[question.category] === state.currentCategory
+        ) {
+          return {
+            questions: [...state.questions, question],
+            totalQuestions: state.totalQuestions + 1,
+          };
+        }
+        return null;
+      });
+    });
+    this.changes.addEventListener("deleted", (event) => {
+      this.removeQuestion(JSON.parse(event.data).id);
+    });
+    // Events were missed; only a reload is accurate.
+    this.changes.addEventListener("reset", () => this.getQuestions());
+  }
+
+  // Takes a deleted question off the page and the count. Both the DELETE
+  // response and the change feed report a delete made here, so each id is
+  // counted once, whichever comes first.
+  removeQuestion(id) {
+    if (this.removed.has(id)) {
+      return;
+    }
+    this.removed.add(id);
+    this.setState((state) => {
+      const shown = state.questions.some((question) => question.id === id);
+      // Category and search views list every match, so a question they do
+      // not show is not theirs; the list counts every question.
+      if (!shown && state.view !== "list") {
+        return null;
+      }
+      return {
+        questions: state.questions.filter((question) => question.id !== id),
+        totalQuestions: Math.max(state.totalQuestions - 1, 0),
+      };
+    });
   }
 
   getQuestions = () => {
@@ -31,6 +108,7 @@ class QuestionView extends Component {
           totalQuestions: result.total_questions,
           categories: result.categories,
           currentCategory: result.current_category,
+          view: "list",
         });
         return;
       },
@@ -73,6 +151,7 @@ class QuestionView extends Component {
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          view: "category",
         });
         return;
       },
@@ -99,6 +178,7 @@ class QuestionView extends Component {
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          view: "search",
         });
         return;
       },
@@ -116,7 +196,9 @@ class QuestionView extends Component {
           url: `/questions/${id}`, //TODO: update request URL
           type: "DELETE",
           success: (result) => {
-            this.getQuestions();
+            // The change feed only carries this process's changes; with
+            // several app processes the event may never arrive here.
+            this.removeQuestion(id);
           },
           error: (error) => {
             alert("Unable to load questions. Please try your request again");
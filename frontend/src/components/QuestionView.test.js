@@ -0,0 +1,81 @@
+import React from 'react';
+import ReactDOM from 'react-dom';
+import { act } from 'react-dom/test-utils';
+import $ from 'jquery';
+import QuestionView from './QuestionView';
+
+class FakeEventSource {
+  constructor() {
+    this.listeners = {};
+    FakeEventSource.last = this;
+  }
+
+  addEventListener(type, listener) {
+    this.listeners[type] = listener;
+  }
+
+  emit(type, data) {
+    this.listeners[type]({ data: JSON.stringify(data) });
+  }
+
+  close() {}
+}
+
+const questions = [
+  { id: 1, question: 'Q1', answer: 'A1', category: 1, difficulty: 1 },
+  { id: 2, question: 'Q2', answer: 'A2', category: 1, difficulty: 2 },
+];
+
+function renderView() {
+  const div = document.createElement('div');
+  let view;
+  act(() => {
+    ReactDOM.render(<QuestionView ref={(ref) => (view = ref)} />, div);
+  });
+  return { div, view };
+}
+
+beforeEach(() => {
+  window.EventSource = FakeEventSource;
+  window.confirm = () => true;
+  jest.spyOn($, 'ajax').mockImplementation((options) => {
+    if (options.type === 'DELETE') {
+      options.success({ success: true });
+    } else {
+      options.success({
+        questions,
+        total_questions: 12,
+        categories: { 1: 'Science' },
+        current_category: null,
+      });
+    }
+  });
+});
+
+afterEach(() => {
+  $.ajax.mockRestore();
+  delete window.EventSource;
+});
+
+it('counts a deleted question shown in the view once', () => {
+  const { div, view } = renderView();
+
+  // The DELETE response and then the change feed both report it.
+  act(() => view.questionAction(1)('DELETE'));
+  act(() => FakeEventSource.last.emit('deleted', { id: 1 }));
+
+  expect(view.state.questions.map((question) => question.id)).toEqual([2]);
+  expect(view.state.totalQuestions).toBe(11);
+  ReactDOM.unmountComponentAtNode(div);
+});
+
+it('counts a delete once when the change feed reports it first', () => {
+  const { div, view } = renderView();
+
+  act(() => FakeEventSource.last.emit('deleted', { id: 2 }));
+  act(() => view.questionAction(2)('DELETE'));
+
+  expect(view.state.questions.map((question) => question.id)).toEqual([1]);
+  expect(view.state.totalQuestions).toBe(11);
+  ReactDOM.unmountComponentAtNode(div);
+});
@@ -10,11 +10,13 @@ class QuizView extends Component {
     this.state = {
       quizCategory: null,
       previousQuestions: [],
+      quizQuestions: [],
       showAnswer: false,
       categories: {},
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      lastCorrect: false,
       forceEnd: false,
     };
   }
@@ -35,27 +37,66 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.getQuizQuestions);
   };
 
   handleChange = (event) => {
     this.setState({ [event.target.name]: event.target.value });
   };
 
+  getQuizQuestions = () => {
+    $.ajax({
+      url: '/quizzes', //TODO: update request URL
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        previous_questions: [],
+        quiz_category: this.state.quizCategory,
+        num_questions: questionsPerPlay,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ quizQuestions: result.questions }, this.getNextQuestion);
+        return;
+      },
+      error: (error) => {
+        alert('Unable to load questions. Please try your request again');
+        return;
+      },
+    });
+  };
+
   getNextQuestion = () => {
     const previousQuestions = [...this.state.previousQuestions];
     if (this.state.currentQuestion.id) {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    const [nextQuestion, ...quizQuestions] = this.state.quizQuestions;
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      quizQuestions: quizQuestions,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true,
+    });
+  };
+
+  submitGuess = (event) => {
+    event.preventDefault();
     $.ajax({
-      url: '/quizzes', //TODO: update request URL
+      url: '/quizzes/answers',
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory,
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess,
       }),
       xhrFields: {
         withCredentials: true,
@@ -63,38 +104,35 @@ class QuizView extends Component {
       crossDomain: true,
       success: (result) => {
         this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true,
+          numCorrect: result.correct
+            ? this.state.numCorrect + 1
+            : this.state.numCorrect,
+          lastCorrect: result.correct,
+          currentQuestion: {
+            ...this.state.currentQuestion,
+            answer: result.answer,
+          },
+          showAnswer: true,
         });
         return;
       },
       error: (error) => {
-        alert('Unable to load question. Please try your request again');
+        alert('Unable to check your answer. Please try again');
         return;
       },
     });
   };
 
-  submitGuess = (event) => {
-    event.preventDefault();
-    let evaluate = this.evaluateAnswer();
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
-    });
-  };
-
   restartGame = () => {
     this.setState({
       quizCategory: null,
       previousQuestions: [],
+      quizQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      lastCorrect: false,
       forceEnd: false,
     });
   };
@@ -139,19 +177,8 @@ class QuizView extends Component {
     );
   }
 
-  evaluateAnswer = () => {
-    const formatGuess = this.state.guess
-      // eslint-disable-next-line
-      .replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g, '')
-      .toLowerCase();
-    const answerArray = this.state.currentQuestion.answer
-      .toLowerCase()
-      .split(' ');
-    return answerArray.every((el) => formatGuess.includes(el));
-  };
-
   renderCorrectAnswer() {
-    let evaluate = this.evaluateAnswer();
+    let evaluate = this.state.lastCorrect;
     return (
       <div className='quiz-play-holder'>
         <div className='quiz-question'>
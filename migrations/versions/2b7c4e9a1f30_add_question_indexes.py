@@ -0,0 +1,40 @@
+"""Add indexes for question filters
+
+Revision ID: 2b7c4e9a1f30
+Revises: 1bfc88d6d313
+Create Date: 2026-10-19 10:12:41.503218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7c4e9a1f30'
+down_revision = '1bfc88d6d313'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (category, id) also serves plain category filters, so there is no
+    # separate single column index on category.
+    op.create_index('ix_questions_category_id', 'questions',
+                    ['category', 'id'], unique=False)
+    op.create_index('ix_questions_difficulty', 'questions',
+                    ['difficulty'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Lets `question ILIKE '%term%'` use an index instead of a scan.
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_questions_question_trgm', 'questions',
+                        ['question'], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={'question': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_questions_question_trgm', table_name='questions')
+    op.drop_index('ix_questions_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category_id', table_name='questions')
@@ -0,0 +1,31 @@
+"""Add leaderboard scores
+
+Revision ID: 3f7a1c9e5b20
+Revises: 8c2f4a6d1e95
+Create Date: 2026-10-19 18:22:53.904712
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f7a1c9e5b20'
+down_revision = '8c2f4a6d1e95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'leaderboard_scores',
+        sa.Column('category_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('player', sa.String(length=80), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('category_id', 'player'))
+
+
+def downgrade():
+    op.drop_table('leaderboard_scores')
@@ -0,0 +1,77 @@
+"""Add question content hash and idempotency keys
+
+Revision ID: 5d1e8f3a7c42
+Revises: 2b7c4e9a1f30
+Create Date: 2026-10-19 14:03:17.220941
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1e8f3a7c42'
+down_revision = '2b7c4e9a1f30'
+branch_labels = None
+depends_on = None
+
+
+def content_hash(question, answer, category):
+    # A copy of models.question_content_hash as of this revision, so the
+    # migration keeps producing the same hashes if the model changes.
+    def normalize(text):
+        return ' '.join(str(text or '').casefold().split())
+
+    content = '\x1f'.join(
+        [normalize(question), normalize(answer), str(category)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # Backfill. When existing rows are duplicates of each other only the
+    # oldest gets the hash; the rest keep NULL, which the unique index
+    # allows, and can be cleaned up by hand.
+    connection = op.get_bind()
+    questions = sa.table(
+        'questions',
+        sa.column('id', sa.Integer),
+        sa.column('question', sa.String),
+        sa.column('answer', sa.String),
+        sa.column('category', sa.Integer),
+        sa.column('content_hash', sa.String))
+    seen = set()
+    rows = connection.execute(sa.select([
+        questions.c.id, questions.c.question, questions.c.answer,
+        questions.c.category]).order_by(questions.c.id)).fetchall()
+    for question_id, question, answer, category in rows:
+        value = content_hash(question, answer, category)
+        if value in seen:
+            continue
+        seen.add(value)
+        connection.execute(
+            questions.update().where(questions.c.id == question_id).values(
+                content_hash=value))
+
+    op.create_index('ux_questions_content_hash', 'questions',
+                    ['content_hash'], unique=True)
+
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=False),
+        sa.Column('response', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key'))
+
+
+def downgrade():
+    op.drop_table('idempotency_keys')
+    op.drop_index('ux_questions_content_hash', table_name='questions')
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,31 @@
+"""Add idempotency key request hash
+
+Revision ID: 6e2b9d4f1a37
+Revises: 3f7a1c9e5b20
+Create Date: 2026-10-19 21:12:40.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2b9d4f1a37'
+down_revision = '3f7a1c9e5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column('request_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys',
+                    ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_keys_created_at',
+                  table_name='idempotency_keys')
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.drop_column('request_hash')
@@ -0,0 +1,45 @@
+"""Add soft delete to questions
+
+Revision ID: 8c2f4a6d1e95
+Revises: 5d1e8f3a7c42
+Create Date: 2026-10-19 16:41:09.318467
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2f4a6d1e95'
+down_revision = '5d1e8f3a7c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(),
+                                      nullable=True))
+
+    # Reads only look at live rows, so the category index only needs to
+    # cover those; the purge job gets its own index over deleted rows.
+    op.drop_index('ix_questions_category_id', table_name='questions')
+    op.create_index('ix_questions_live_category_id', 'questions',
+                    ['category', 'id'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NULL'),
+                    sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_questions_deleted_at', 'questions',
+                    ['deleted_at'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'),
+                    sqlite_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade():
+    # Soft-deleted rows would come back to life without the column.
+    op.execute('DELETE FROM questions WHERE deleted_at IS NOT NULL')
+    op.drop_index('ix_questions_deleted_at', table_name='questions')
+    op.drop_index('ix_questions_live_category_id', table_name='questions')
+    op.create_index('ix_questions_category_id', 'questions',
+                    ['category', 'id'], unique=False)
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
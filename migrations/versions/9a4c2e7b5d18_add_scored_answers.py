@@ -0,0 +1,30 @@
+"""Add scored answers
+
+Revision ID: 9a4c2e7b5d18
+Revises: 6e2b9d4f1a37
+Create Date: 2026-10-19 23:05:17.284613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c2e7b5d18'
+down_revision = '6e2b9d4f1a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scored_answers',
+        sa.Column('player', sa.String(length=80), nullable=False),
+        sa.Column('question_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('player', 'question_id'))
+
+
+def downgrade():
+    op.drop_table('scored_answers')
@@ -0,0 +1,33 @@
+"""Add questions revision
+
+Revision ID: b3d8f1e6a254
+Revises: 9a4c2e7b5d18
+Create Date: 2026-10-20 00:14:52.631907
+
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8f1e6a254'
+down_revision = '9a4c2e7b5d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = op.create_table(
+        'questions_revision',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('token', sa.String(length=32), nullable=False),
+        sa.Column('revision', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'))
+    op.bulk_insert(table, [
+        {'id': 1, 'token': uuid.uuid4().hex, 'revision': 0}])
+
+
+def downgrade():
+    op.drop_table('questions_revision')